@@ -13,15 +13,22 @@ A Maya engine for Tank.
 
 """
 
+import time
+
+# time the engine module started loading, before the modules it imports
+_MODULE_LOAD_TIME_STAMP = time.time()
+
 import tank
 import sys
 import traceback
-import time
 import os
 import logging
 import maya.OpenMaya as OpenMaya
-import pymel.core as pm
 import maya.cmds as cmds
+import maya.mel as mel
+
+# time in seconds the modules imported by the engine module took to import
+_MODULE_IMPORT_DURATION = time.time() - _MODULE_LOAD_TIME_STAMP
 
 ###############################################################################################
 # methods to support the state when the engine cannot start up
@@ -37,23 +44,37 @@ class SceneEventWatcher(object):
 
     Specifying run_once=True in the constructor causes all events to be
     cleaned up after the first one has triggered
+
+    An optional callback can also be notified with the path of the file
+    about to be opened, before Maya starts loading it.
+
+    Scene events are not routed to the callback right away: bursts of events,
+    for example several saves in a row, are collapsed into a single call made
+    once Maya is idle, which then only deals with the latest scene.
     """
     def __init__(self, cb_fn,
                  scene_events = [OpenMaya.MSceneMessage.kAfterOpen,
                                  OpenMaya.MSceneMessage.kAfterSave,
                                  OpenMaya.MSceneMessage.kAfterNew],
-                 run_once=False):
+                 run_once=False,
+                 before_open_cb_fn=None):
         """
         Constructor.
 
         :param cb_fn: Callcack to invoke everytime a scene event happens.
         :param scene_events: List of scene events to watch for. Defaults to new, open and save.
         :param run_once: If True, the watcher will notify only on the first event. Defaults to False.
+        :param before_open_cb_fn: Callback to invoke with the path of the file about to be opened.
+                                  Defaults to None.
         """
         self.__message_ids = []
         self.__cb_fn = cb_fn
         self.__scene_events = scene_events
         self.__run_once=run_once
+        self.__before_open_cb_fn = before_open_cb_fn
+        # True when a call to the callback is scheduled for when Maya is idle
+        self.__pending = False
+        self.__event_counts = {"received": 0, "coalesced": 0, "processed": 0}
 
         # register scene event callbacks:
         self.start_watching()
@@ -74,6 +95,10 @@ class SceneEventWatcher(object):
                 continue
             self.__message_ids.append(msg_id);
 
+        if self.__before_open_cb_fn:
+            msg_id = OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kBeforeOpen, SceneEventWatcher.__before_open_callback, self)
+            self.__message_ids.append(msg_id)
+
         # create a callback that will be run when Maya
         # exits so we can do some clean-up:
         msg_id = OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kMayaExiting, SceneEventWatcher.__maya_exiting_callback, self)
@@ -81,20 +106,58 @@ class SceneEventWatcher(object):
 
     def stop_watching(self):
         """
-        Stops watching the Maya scene.
+        Stops watching the Maya scene. Scene events not routed
+        to the callback yet are dropped.
         """
         for msg_id in self.__message_ids:
             OpenMaya.MMessage.removeCallback(msg_id)
         self.__message_ids = []
+        self.__pending = False
+
+    @property
+    def event_counts(self):
+        """
+        Dictionary with the number of scene events ``received``, the number of events
+        ``coalesced`` with a later one and the number of calls to the callback made
+        after these events, ``processed``.
+        """
+        return dict(self.__event_counts)
 
     @staticmethod
     def __scene_event_callback(watcher):
         """
         Called on a scene event:
         """
-        if watcher.__run_once:
-            watcher.stop_watching()
-        watcher.__cb_fn()
+        watcher.__event_counts["received"] += 1
+        if watcher.__pending:
+            # the callback is already scheduled, and reads the scene opened when it runs
+            watcher.__event_counts["coalesced"] += 1
+            return
+        watcher.__pending = True
+        import maya.utils
+        maya.utils.executeDeferred(watcher.__process_pending_event)
+
+    def __process_pending_event(self):
+        """
+        Routes the scene events received since the last call to the callback.
+        """
+        if not self.__pending:
+            # stopped watching in the meantime
+            return
+        self.__pending = False
+        self.__event_counts["processed"] += 1
+        if self.__run_once:
+            self.stop_watching()
+        self.__cb_fn()
+
+    @staticmethod
+    def __before_open_callback(watcher):
+        """
+        Called before a scene is opened, with the file about to be loaded.
+        """
+        path = OpenMaya.MFileIO.beforeOpenFilename()
+        if path:
+            watcher.__before_open_cb_fn(path)
 
     @staticmethod
     def __maya_exiting_callback(watcher):
@@ -108,6 +171,14 @@ def refresh_engine(engine_name, prev_context, menu_name):
     refresh the current engine
     """
     current_engine = tank.platform.current_engine()
+    resolver = current_engine.scene_resolver
+
+    # a file in a folder recently found to be outside of any project
+    # will not resolve either, and the disabled menu is already shown
+    scene_name = cmds.file(query=True, sceneName=True)
+    if scene_name and resolver.is_unresolved(os.path.abspath(scene_name)):
+        if cmds.about(batch=True) or cmds.menu("ShotgunMenuDisabled", exists=True):
+            return current_engine
 
     # first make sure that the disabled menu is removed, if it exists...
     menu_was_disabled = remove_sgtk_disabled_menu()
@@ -115,7 +186,7 @@ def refresh_engine(engine_name, prev_context, menu_name):
     # determine the tk instance and ctx to use:
     tk = current_engine.sgtk
     ctx = prev_context
-    if pm.sceneName() == "":
+    if scene_name == "":
         # if the scene opened is actually a file->new, then maintain the current
         # context/engine.
         if not menu_was_disabled:
@@ -123,31 +194,46 @@ def refresh_engine(engine_name, prev_context, menu_name):
             return current_engine
     else:
         # loading a scene file
-        new_path = pm.sceneName().abspath()
+        new_path = os.path.abspath(scene_name)
 
-        # this file could be in another project altogether, so create a new
-        # API instance.
+        # this file could be in another project altogether, so get the API
+        # instance for its project, reusing the one of a project already seen.
         try:
-            tk = tank.tank_from_path(new_path)
+            tk = resolver.get_tk(new_path)
         except tank.TankError, e:
             OpenMaya.MGlobal.displayInfo("Shotgun: Engine cannot be started: %s" % e)
             # build disabled menu
-            create_sgtk_disabled_menu(menu_name)
+            create_sgtk_disabled_menu(menu_name, resolver)
             return current_engine
 
         # and construct the new context for this path:
-        ctx = tk.context_from_path(new_path, prev_context)
+        ctx = resolver.get_context(tk, new_path, prev_context)
 
+    log_file_writer = None
     if current_engine:
         # if context is unchanged and the menu was not previously disabled
         # then no need to rebuild the same engine again!
         if ctx == prev_context and not menu_was_disabled:
             return current_engine
 
-        # tear down existing engine
         current_engine.log_debug("Ready to switch to context because of scene event !")
-        current_engine.log_debug("Prev context: %s" % prev_context)
-        current_engine.log_debug("New context: %s" % ctx)
+        current_engine.log_debug("Prev context: %s", prev_context)
+        current_engine.log_debug("New context: %s", ctx)
+
+        # when the new context belongs to the same pipeline configuration, the running
+        # engine can switch to it in place, keeping its menu, panels and unchanged apps.
+        # This is not the case when the menu was disabled, since the engine menu is gone.
+        switch_start_time = time.time()
+        if not menu_was_disabled and _can_change_context_in_place(current_engine, tk):
+            tank.platform.change_context(ctx)
+            resolver.record_context_switch("in_place", time.time() - switch_start_time)
+            return current_engine
+
+        # keep the log file open while the new engine starts, for the new engine
+        # to take its writer over rather than opening the file a second time
+        log_file_writer = current_engine.keep_log_file_open()
+
+        # tear down existing engine
         current_engine.destroy()
 
     # start new engine
@@ -157,13 +243,42 @@ def refresh_engine(engine_name, prev_context, menu_name):
     except tank.TankEngineInitError, e:
         OpenMaya.MGlobal.displayInfo("Shotgun: Engine cannot be started: %s" % e)
         # build disabled menu
-        create_sgtk_disabled_menu(menu_name)
+        create_sgtk_disabled_menu(menu_name, resolver)
     else:
+        # keep the API instances cached so far for the new engine
+        new_engine.adopt_scene_resolver(resolver)
+        if current_engine and current_engine.log_records is not None:
+            # and the recent log messages, which tell what led to the restart
+            new_engine.adopt_log_records(current_engine.log_records)
         new_engine.log_debug("Launched new engine for context!")
+        if current_engine:
+            resolver.record_context_switch("restart", time.time() - switch_start_time)
+    finally:
+        if log_file_writer is not None:
+            log_file_writer.close()
 
     return new_engine
 
 
+def _can_change_context_in_place(engine, tk):
+    """
+    Tells if an engine can switch to a context resolved with a given API instance
+    without being restarted.
+
+    The scene resolver hands out the API instance of the engine for as long as its
+    pipeline configuration is unchanged on disk. Any other instance, even of the same
+    pipeline configuration, means the engine runs on a stale configuration and must
+    be restarted.
+
+    :param engine: Engine currently running.
+    :param tk: Toolkit API instance the new context was resolved with.
+    :returns: True if the context can be changed in place, False otherwise.
+    """
+    if not engine.context_change_allowed or not hasattr(tank.platform, "change_context"):
+        return False
+    return tk is engine.sgtk
+
+
 def on_scene_event_callback(engine_name, prev_context, menu_name):
     """
     Callback that's run whenever a scene is saved or opened.
@@ -205,20 +320,39 @@ def sgtk_disabled_message():
                 dismissString="Ok" )
 
 
-def create_sgtk_disabled_menu(menu_name):
+def clear_unresolved_paths(resolver):
+    """
+    Forget the files found not to belong to any project,
+    so that the next scene event tries to resolve them again.
+
+    :param resolver: Scene resolver holding the files found not to resolve.
+    """
+    count = resolver.clear_unresolved_paths()
+    OpenMaya.MGlobal.displayInfo("Shotgun: Forgot %d unrecognized folders, they will be "
+                                 "checked again on the next open or save." % count)
+
+
+def create_sgtk_disabled_menu(menu_name, resolver=None):
     """
     Render a special "shotgun is disabled" menu
+
+    :param menu_name: Label of the menu.
+    :param resolver: Scene resolver holding the files found not to resolve, if any.
     """
     if cmds.about(batch=True):
         # don't create menu in batch mode
         return
 
-    if pm.menu("ShotgunMenu", exists=True):
-        pm.deleteUI("ShotgunMenu")
+    if cmds.menu("ShotgunMenu", exists=True):
+        cmds.deleteUI("ShotgunMenu")
 
-    sg_menu = pm.menu("ShotgunMenuDisabled", label=menu_name, parent=pm.melGlobals["gMainWindow"])
-    pm.menuItem(label="Sgtk is disabled.", parent=sg_menu,
-                command=lambda arg: sgtk_disabled_message())
+    sg_menu = cmds.menu("ShotgunMenuDisabled", label=menu_name, parent=_get_main_window_name())
+    cmds.menuItem(label="Sgtk is disabled.", parent=sg_menu,
+                  command=lambda arg: sgtk_disabled_message())
+    if resolver is not None:
+        cmds.menuItem(label="Forget Unrecognized Folders", parent=sg_menu,
+                      annotation="Check again files which were recently found outside of any project.",
+                      command=lambda arg: clear_unresolved_paths(resolver))
 
 
 def remove_sgtk_disabled_menu():
@@ -231,12 +365,19 @@ def remove_sgtk_disabled_menu():
         # don't create menu in batch mode
         return False
 
-    if pm.menu("ShotgunMenuDisabled", exists=True):
-        pm.deleteUI("ShotgunMenuDisabled")
+    if cmds.menu("ShotgunMenuDisabled", exists=True):
+        cmds.deleteUI("ShotgunMenuDisabled")
         return True
 
     return False
 
+
+def _get_main_window_name():
+    """
+    Returns the name of the Maya main window, as stored in the gMainWindow MEL global.
+    """
+    return mel.eval("$tmp_main_window = $gMainWindow")
+
 ###############################################################################################
 # The Tank Maya engine
 
@@ -249,6 +390,27 @@ class MayaEngine(tank.platform.Engine):
     # Initialize it with the current time for lack of a better value.
     _debug_msg_time_stamp = time.time()
 
+    # Cached value of the debug_logging setting, refreshed when the settings change.
+    # None until the engine is initialized, in which case the setting is looked up.
+    _debug_logging = None
+
+    # Queue of the messages displayed in the script editor, created once the apps are initialized.
+    # Defined at the class level since messages are logged before the engine is initialized.
+    __script_editor_log = None
+    # Scheduler of the deferred work, created once the apps are initialized.
+    # Defined at the class level since messages are logged before the engine is initialized.
+    __scheduler = None
+    # Buffer of the recent log messages and log file writer, created before the apps are initialized.
+    __log_records = None
+    __log_file_writer = None
+    # Set when the log file writer is kept open for the next engine.
+    __log_file_kept_open = False
+    # Set once the engine is destroyed, for the work it deferred to be skipped.
+    __destroyed = False
+
+    # Number of recent log messages kept in memory.
+    LOG_BUFFER_SIZE = 2000
+
     @property
     def context_change_allowed(self):
         """
@@ -271,11 +433,22 @@ class MayaEngine(tank.platform.Engine):
         QtCore.QTextCodec.setCodecForCStrings(utf8)
         self.log_debug("set utf-8 codec for widget text")
 
+        # keep the recent log messages in memory, and write them to disk when configured to
+        tk_maya = self.import_module("tk_maya")
+        self.__log_records = tk_maya.LogRecordBuffer(self.LOG_BUFFER_SIZE)
+        if self.get_setting("log_to_file", False):
+            self.__log_file_writer = tk_maya.LogFileWriter(os.path.join(self.cache_location, "tk-maya.log"))
+            self.log_debug("Writing log messages to %s.", self.__log_file_writer.path)
+
     def init_engine(self):
         """
         Initializes the Maya engine.
         """
-        self.log_debug("%s: Initializing..." % self)
+        self._refresh_debug_logging()
+        self.log_debug("%s: Initializing...", self)
+
+        # keep track of how long it takes for the engine to start
+        self.__init_time_stamp = time.time()
 
         # check that we are running an ok version of maya
         current_os = cmds.about(operatingSystem=True)
@@ -287,7 +460,7 @@ class MayaEngine(tank.platform.Engine):
         if maya_ver.startswith("Maya "):
             maya_ver = maya_ver[5:]
         if maya_ver.startswith(("2014", "2015", "2016")):
-            self.log_debug("Running Maya version %s" % maya_ver)
+            self.log_debug("Running Maya version %s", maya_ver)
         elif maya_ver.startswith(("2012", "2013")):
             # We won't be able to rely on the warning dialog below, because Maya
             # older than 2014 doesn't ship with PySide. Instead, we just have to
@@ -325,6 +498,13 @@ class MayaEngine(tank.platform.Engine):
 
         self._maya_version = maya_ver
 
+        # registry of the commands registered by the apps, created on demand
+        self.__command_registry = None
+        # history of the commands launched by the user, loaded on demand
+        self.__launch_history = None
+        # resolver of the API instance and context of scene files, created on demand
+        self.__scene_resolver = None
+
         try:
             self.log_user_attribute_metric("Maya version", maya_ver)
         except:
@@ -345,8 +525,16 @@ class MayaEngine(tank.platform.Engine):
 
         if self.get_setting("automatic_context_switch", True):
             # need to watch some scene events in case the engine needs rebuilding:
-            cb_fn = lambda en=self.instance_name, pc=self.context, mn=self._menu_name:on_scene_event_callback(en, pc, mn)
-            self.__watcher = SceneEventWatcher(cb_fn)
+            # the context is looked up when the event happens, since it changes
+            # when the engine switches to a new context in place
+            cb_fn = lambda en=self.instance_name, mn=self._menu_name:on_scene_event_callback(en, self.context, mn)
+            before_open_cb_fn = None
+            if self.has_ui:
+                # resolve the file being opened while Maya loads it. In batch mode, the worker
+                # thread would log to the script editor off the main thread, which Maya does
+                # not support, as deferred work runs right away without an event loop
+                before_open_cb_fn = lambda path: self.scene_resolver.prefetch(os.path.abspath(path), self.context)
+            self.__watcher = SceneEventWatcher(cb_fn, before_open_cb_fn=before_open_cb_fn)
             self.log_debug("Registered open and save callbacks.")
 
     def post_app_init(self):
@@ -354,43 +542,208 @@ class MayaEngine(tank.platform.Engine):
         Called when all apps have initialized
         """
 
+        # from now on, run the deferred work of the engine when Maya is idle
+        tk_maya = self.import_module("tk_maya")
+        self.__scheduler = tk_maya.IdleScheduler(self)
+        self.__script_editor_log = tk_maya.ScriptEditorLog(self, self.get_setting("max_log_messages_per_second", 200))
+
         # detect if in batch mode
         if self.has_ui:
-            self._menu_handle = pm.menu("ShotgunMenu", label=self._menu_name, parent=pm.melGlobals["gMainWindow"])
+            self._menu_handle = cmds.menu("ShotgunMenu", label=self._menu_name, parent=_get_main_window_name())
             # create our menu handler
-            tk_maya = self.import_module("tk_maya")
             self._menu_generator = tk_maya.MenuGenerator(self, self._menu_handle)
             # hook things up so that the menu is created every time it is clicked
-            self._menu_handle.postMenuCommand(self._menu_generator.create_menu)
+            cmds.menu(self._menu_handle, edit=True, postMenuCommand=self._menu_generator.create_menu)
+            # build the menu ahead of time so that the first click is instant
+            self._schedule_menu_prebuild()
+            # make the quick launch palette available from the keyboard
+            self._install_command_palette_shortcut()
 
-        # Run a series of app instance commands at startup.
+        # Run a series of app instance commands once Maya is idle after startup.
         self._run_app_instance_commands()
 
+        # pymel takes seconds to import, so the engine only relies on maya.cmds and OpenMaya
+        # and leaves it to the apps needing pymel to import it
+        self.log_debug(
+            "Engine started in %0.3fs since its module was loaded, its imports taking %0.3fs "
+            "and its initialization %0.3fs, pymel %s.",
+            time.time() - _MODULE_LOAD_TIME_STAMP,
+            _MODULE_IMPORT_DURATION,
+            time.time() - self.__init_time_stamp,
+            "is loaded" if "pymel.core" in sys.modules else "is not loaded"
+        )
+
+        if self.has_ui:
+            # import the modules of the apps the user launches the most once Maya is idle
+            self.scheduler.schedule(self.scheduler.PRIORITY_LOW, self._warm_up_most_used_apps)
+            # and resolve the files the user is likely to open next
+            self.scheduler.schedule(self.scheduler.PRIORITY_LOW, self._warm_up_scene_resolution)
+
+
+    def post_context_change(self, old_context, new_context):
+        """
+        Runs after a context change, once the apps have been updated for the new context.
+
+        :param old_context: The previous context.
+        :param new_context: The current context.
+        """
+        # the settings of the new context may turn debug logging on or off
+        self._refresh_debug_logging()
+
+        # Set the Maya project based on the new context
+        self._set_project()
+
+        if self.has_ui:
+            # build the menu for the new context ahead of time
+            self._schedule_menu_prebuild()
+            # and resolve the files of its work area
+            self.scheduler.schedule(self.scheduler.PRIORITY_LOW, self._warm_up_scene_resolution)
+
+    def _schedule_menu_prebuild(self):
+        """
+        Schedules a build of the Shotgun menu for when Maya is idle.
+        """
+        self.scheduler.schedule(self.scheduler.PRIORITY_LOW, self._menu_generator.prebuild_menu)
+
+    def _warm_up_scene_resolution(self):
+        """
+        Resolves in the background the files of Maya recent files list and
+        of the current context work area.
+        """
+        if self.destroyed:
+            # the engine was destroyed since this task was scheduled
+            return
+
+        # most recent files are last in the list
+        recent_files = cmds.optionVar(query="RecentFilesList") or []
+        if not isinstance(recent_files, list):
+            recent_files = [recent_files]
+        recent_files.reverse()
+        self.scene_resolver.warm_up(recent_files, self.context)
+
+    def _install_command_palette_shortcut(self):
+        """
+        Installs the keyboard shortcut opening the quick launch palette.
+        """
+        from tank.platform.qt import QtCore, QtGui
+
+        self._command_palette = None
+        self._command_palette_shortcut = None
+
+        key_sequence = self.get_setting("quick_launch_shortcut", "")
+        if not key_sequence:
+            return
+
+        self._command_palette_shortcut = QtGui.QShortcut(QtGui.QKeySequence(key_sequence),
+                                                         self._get_dialog_parent())
+        self._command_palette_shortcut.setContext(QtCore.Qt.ApplicationShortcut)
+        self._command_palette_shortcut.activated.connect(self.show_command_palette)
+        self.log_debug("Installed quick launch palette shortcut %s.", key_sequence)
+
+    def show_command_palette(self):
+        """
+        Shows the quick launch palette to search and run commands from the keyboard.
+        """
+        if self._command_palette is None:
+            tk_maya = self.import_module("tk_maya")
+            self._command_palette = tk_maya.CommandPalette(self, self._get_dialog_parent())
+        self._command_palette.popup()
+
+    @property
+    def launch_history(self):
+        """
+        History of the launch counts and latencies of the commands,
+        stored on disk in the user cache location.
+        """
+        if self.__launch_history is None:
+            tk_maya = self.import_module("tk_maya")
+            path = os.path.join(self.cache_location, "launch_history.json")
+            self.__launch_history = tk_maya.LaunchHistory(self, path)
+        return self.__launch_history
+
+    def _warm_up_most_used_apps(self):
+        """
+        Imports ahead of time the modules of the apps whose commands were launched the most,
+        so that launching them does not pay for these imports.
+        """
+        if self.destroyed:
+            # the engine was destroyed since this task was scheduled
+            return
+
+        app_count = self.get_setting("warm_up_app_count", 3)
+        if not app_count:
+            return
+
+        try:
+            from tank.platform.import_stack import ImportStack
+        except ImportError:
+            # the modules of an app can only be imported within the context of their app,
+            # which the core keeps on its import stack, for them to import frameworks
+            self.log_debug("Not warming up the most used apps, the core has no import stack.")
+            return
+
+        tk_maya = self.import_module("tk_maya")
+        app_modules = []
+        for app_instance_name in self.launch_history.most_used_app_instances(app_count):
+            app = self.apps.get(app_instance_name)
+            if app:
+                app_modules.extend((app, name) for name in tk_maya.find_unloaded_app_modules(app))
+
+        self.log_debug("Warming up %d modules of the most used apps.", len(app_modules))
+        # import the modules one by one, so that the imports are spread over idle ticks
+        for (app, module_name) in app_modules:
+            self.scheduler.schedule(self.scheduler.PRIORITY_LOW, self._warm_up_module, app, module_name)
+
+    def _warm_up_module(self, app, module_name):
+        """
+        Imports a module of an app ahead of time, within the context of the app,
+        as the core does when the app imports it.
+
+        :param app: App object the module belongs to.
+        :param module_name: Name of the module to import.
+        """
+        if self.destroyed:
+            # the engine was destroyed since this task was scheduled
+            return
+
+        from tank.platform.import_stack import ImportStack
+        ImportStack.push_current_bundle(app)
+        try:
+            __import__(module_name)
+        except Exception, e:
+            # the module is imported again, and fails properly, when the app needs it
+            sys.modules.pop(module_name, None)
+            self.log_debug("Could not warm up module %s: %s", module_name, e)
+        finally:
+            ImportStack.pop_current_bundle()
 
     def _run_app_instance_commands(self):
         """
-        Runs the series of app instance commands listed in the 'run_at_startup' setting
-        of the environment configuration yaml file.
+        Schedules the series of app instance commands listed in the 'run_at_startup' setting
+        of the environment configuration yaml file, to run once Maya is idle.
         """
 
-        # Build a dictionary mapping app instance names to dictionaries of commands they registered with the engine.
-        app_instance_commands = {}
-        for (command_name, value) in self.commands.iteritems():
-            app_instance = value["properties"].get("app")
-            if app_instance:
-                # Add entry 'command name: command function' to the command dictionary of this app instance.
-                command_dict = app_instance_commands.setdefault(app_instance.instance_name, {})
-                command_dict[command_name] = value["callback"]
+        # The command registry maps app instance names to dictionaries of commands they registered with the engine.
+        registry = self.command_registry
+
+        # Commands with a higher priority run first, the others in the order of the 'run_at_startup' setting.
+        startup_settings = sorted(self.get_setting("run_at_startup", []),
+                                  key=lambda app_setting_dict: -app_setting_dict.get("priority", 0))
 
-        # Run the series of app instance commands listed in the 'run_at_startup' setting.
-        for app_setting_dict in self.get_setting("run_at_startup", []):
+        # Schedule the series of app instance commands listed in the 'run_at_startup' setting.
+        for app_setting_dict in startup_settings:
 
             app_instance_name = app_setting_dict["app_instance"]
             # Menu name of the command to run or '' to run all commands of the given app instance.
             setting_command_name = app_setting_dict["name"]
+            # Deferred commands only run after the other deferred work of the engine.
+            if app_setting_dict.get("defer", False):
+                priority = self.scheduler.PRIORITY_IDLE
+            else:
+                priority = self.scheduler.PRIORITY_NORMAL
 
             # Retrieve the command dictionary of the given app instance.
-            command_dict = app_instance_commands.get(app_instance_name)
+            command_dict = registry.get_app_instance_commands(app_instance_name)
 
             if command_dict is None:
                 self.log_warning(
@@ -399,17 +752,13 @@ class MayaEngine(tank.platform.Engine):
             else:
                 if not setting_command_name:
                     # Run all commands of the given app instance.
-                    for (command_name, command_function) in command_dict.iteritems():
-                        self.log_debug("%s startup running app '%s' command '%s'." %
-                                       (self.name, app_instance_name, command_name))
-                        command_function()
+                    for (command_name, command) in sorted(command_dict.iteritems()):
+                        self.scheduler.schedule(priority, self._run_startup_command, app_instance_name, command)
                 else:
                     # Run the command whose name is listed in the 'run_at_startup' setting.
-                    command_function = command_dict.get(setting_command_name)
-                    if command_function:
-                        self.log_debug("%s startup running app '%s' command '%s'." %
-                                       (self.name, app_instance_name, setting_command_name))
-                        command_function()
+                    command = command_dict.get(setting_command_name)
+                    if command:
+                        self.scheduler.schedule(priority, self._run_startup_command, app_instance_name, command)
                     else:
                         known_commands = ', '.join("'%s'" % name for name in command_dict)
                         self.log_warning(
@@ -417,20 +766,133 @@ class MayaEngine(tank.platform.Engine):
                             "Known commands: %s" %
                             (self.name, app_instance_name, setting_command_name, known_commands))
 
+    def _run_startup_command(self, app_instance_name, command):
+        """
+        Runs an app instance command listed in the 'run_at_startup' setting and logs how long it took.
+
+        :param app_instance_name: Name of the app instance which registered the command.
+        :param command: :class:`AppCommand` record of the command.
+        """
+        if self.destroyed:
+            # the engine was destroyed since this task was scheduled
+            return
+
+        start_time = time.time()
+        self.log_debug("%s startup running app '%s' command '%s', %0.3fs after the engine started.",
+                       self.name, app_instance_name, command.name, start_time - self.__init_time_stamp)
+        try:
+            command.callback()
+        except Exception:
+            self.log_exception("%s startup failed to run app '%s' command '%s'." %
+                               (self.name, app_instance_name, command.name))
+        self.log_debug("%s startup ran app '%s' command '%s' in %0.3fs.",
+                       self.name, app_instance_name, command.name, time.time() - start_time)
+
+
+    ##########################################################################################
+    # command registry
+
+    def register_command(self, name, callback, properties=None):
+        """
+        Registers a new command with the engine.
+
+        Overridden to flag the command registry as needing a synchronization.
+        """
+        if self.__command_registry is not None:
+            self.__command_registry.invalidate()
+        return super(MayaEngine, self).register_command(name, callback, properties)
+
+    @property
+    def destroyed(self):
+        """
+        True once the engine is destroyed. The work deferred by the engine checks this
+        rather than the current engine, which is not set yet while the engine starts.
+        """
+        return self.__destroyed
+
+    @property
+    def scheduler(self):
+        """
+        Scheduler running the deferred work of the engine when Maya is idle.
+        """
+        if self.__scheduler is None:
+            tk_maya = self.import_module("tk_maya")
+            self.__scheduler = tk_maya.IdleScheduler(self)
+        return self.__scheduler
+
+    @property
+    def command_registry(self):
+        """
+        Registry of the commands registered with the engine, kept sorted,
+        grouped by app and indexed by app instance.
+        """
+        if self.__command_registry is None:
+            tk_maya = self.import_module("tk_maya")
+            self.__command_registry = tk_maya.CommandRegistry(self)
+        return self.__command_registry
 
     def destroy_engine(self):
         """
         Stops watching scene events and tears down menu.
         """
-        self.log_debug("%s: Destroying..." % self)
+        self.log_debug("%s: Destroying...", self)
+        self.__destroyed = True
+
+        if self.__scheduler is not None:
+            # the deferred work of this engine must not run against the next engine
+            self.log_debug("Deferred tasks run: %(processed)d in %(ticks)d ticks, waiting: %(queue_depth)d "
+                           "(at most %(max_queue_depth)d), latency: %(average_latency)0.3fs on average, "
+                           "%(max_latency)0.3fs at most.", self.__scheduler.stats)
+            if self.__script_editor_log is not None:
+                # display the messages logged so far, and the next ones on their own
+                self.__script_editor_log.flush()
+                self.__script_editor_log = None
+            if self.__launch_history is not None:
+                # save the launches whose save was still waiting to run
+                self.__launch_history.flush()
+            dropped_count = self.__scheduler.stop()
+            self.log_debug("Dropped %d deferred tasks.", dropped_count)
 
         if self.get_setting("automatic_context_switch", True):
             # stop watching scene events
             self.__watcher.stop_watching()
+            self.log_debug("Scene events received: %(received)d, coalesced: %(coalesced)d, "
+                           "processed: %(processed)d.", self.__watcher.event_counts)
+
+        if self.__scene_resolver is not None:
+            # the warm up is started again by the next engine, for its own context
+            self.__scene_resolver.cancel_warm_up()
 
         # clean up UI:
-        if self.has_ui and pm.menu(self._menu_handle, exists=True):
-            pm.deleteUI(self._menu_handle)
+        if self.has_ui and cmds.menu(self._menu_handle, exists=True):
+            cmds.deleteUI(self._menu_handle)
+
+        if self.has_ui:
+            # remove the quick launch palette and its shortcut from Maya main window
+            for widget in (self._command_palette_shortcut, self._command_palette):
+                if widget is not None:
+                    widget.setParent(None)
+                    widget.deleteLater()
+            self._command_palette = None
+            self._command_palette_shortcut = None
+
+        if self.has_ui:
+            # report the time taken by the command enable callbacks, slowest first
+            timings = self._menu_generator.enable_states.timings
+            for command_name in sorted(timings, key=lambda name: timings[name]["max"], reverse=True):
+                timing = timings[command_name]
+                self.log_debug("Enable callback of command '%s' evaluated %d times, in %0.3fs on average, "
+                               "%0.3fs at most.", command_name, timing["count"],
+                               timing["total"] / timing["count"], timing["max"])
+
+            tk_maya = self.import_module("tk_maya")
+            self.log_debug("Panel repaints requested: %(requested)d, performed: %(performed)d.",
+                           tk_maya.get_repaint_counts())
+
+        if self.__log_file_writer is not None:
+            if not self.__log_file_kept_open:
+                self.__log_file_writer.close()
+            self.__log_file_writer = None
 
     def _init_pyside(self):
         """
@@ -461,13 +923,13 @@ class MayaEngine(tank.platform.Engine):
 
         if sys.platform == "darwin":
             pyside_path = os.path.join(self.disk_location, "resources","pyside112_py26_qt471_mac", "python")
-            self.log_debug("Adding pyside to sys.path: %s" % pyside_path)
+            self.log_debug("Adding pyside to sys.path: %s", pyside_path)
             sys.path.append(pyside_path)
 
         elif sys.platform == "win32":
             # default windows version of pyside for 2011 and 2012
             pyside_path = os.path.join(self.disk_location, "resources","pyside111_py26_qt471_win64", "python")
-            self.log_debug("Adding pyside to sys.path: %s" % pyside_path)
+            self.log_debug("Adding pyside to sys.path: %s", pyside_path)
             sys.path.append(pyside_path)
             dll_path = os.path.join(self.disk_location, "resources","pyside111_py26_qt471_win64", "lib")
             path = os.environ.get("PATH", "")
@@ -476,7 +938,7 @@ class MayaEngine(tank.platform.Engine):
 
         elif sys.platform == "linux2":
             pyside_path = os.path.join(self.disk_location, "resources","pyside112_py26_qt471_linux", "python")
-            self.log_debug("Adding pyside to sys.path: %s" % pyside_path)
+            self.log_debug("Adding pyside to sys.path: %s", pyside_path)
             sys.path.append(pyside_path)
 
         else:
@@ -522,6 +984,94 @@ class MayaEngine(tank.platform.Engine):
     ##########################################################################################
     # logging
 
+    def _display_log_message(self, level, msg, prefix=""):
+        """
+        Displays a message in Maya script editor in a thread safe manner.
+
+        :param level: Standard python logging level of the message.
+        :param msg: Message to display.
+        :param prefix: Text displayed before the message, which is not compared
+                       when collapsing identical messages.
+        """
+        self._record_log_message(level, prefix + msg)
+
+        if self.__script_editor_log is not None:
+            self.__script_editor_log.post(level, msg, prefix)
+            return
+
+        msg = prefix + msg
+
+        # the apps are still initializing, display the message on its own
+        if level < logging.WARNING:
+            fct = OpenMaya.MGlobal.displayInfo
+        elif level < logging.ERROR:
+            fct = OpenMaya.MGlobal.displayWarning
+        else:
+            fct = OpenMaya.MGlobal.displayError
+        self.async_execute_in_main_thread(fct, msg)
+
+    def _record_log_message(self, level, msg):
+        """
+        Adds a message to the buffer of the recent log messages and to the log file.
+
+        :param level: Standard python logging level of the message.
+        :param msg: Message to record.
+        """
+        if self.__log_records is None:
+            # the engine is still initializing
+            return
+        record = logging.makeLogRecord({
+            "name": self.name,
+            "levelno": level,
+            "levelname": logging.getLevelName(level),
+            "msg": msg,
+        })
+        self.__log_records.add(record)
+        if self.__log_file_writer is not None:
+            self.__log_file_writer.write(record)
+
+    def dump_log_records(self):
+        """
+        Writes the recent log messages kept in memory to a file of the user cache location,
+        for example to send them to support.
+
+        :returns: Path of the file written.
+        """
+        path = os.path.join(self.cache_location, "tk-maya_%s.log" % time.strftime("%Y%m%d_%H%M%S"))
+        self.__log_records.dump(path)
+        self.log_info("Recent log messages written to %s" % path)
+        return path
+
+    def keep_log_file_open(self):
+        """
+        Keeps the log file open when the engine is destroyed, so that the next engine
+        takes its writer over rather than opening the file a second time.
+
+        :returns: The :class:`LogFileWriter` of the engine, for the caller to close
+                  once the next engine started, or None if the engine does not log
+                  to a file.
+        """
+        self.__log_file_kept_open = self.__log_file_writer is not None
+        return self.__log_file_writer
+
+    @property
+    def log_records(self):
+        """
+        :class:`LogRecordBuffer` of the recent log messages kept in memory,
+        None until the engine is initialized.
+        """
+        return self.__log_records
+
+    def adopt_log_records(self, records):
+        """
+        Takes over the recent log messages of a previous engine instance, so that they
+        carry over engine restarts. The messages logged by this engine so far follow them.
+
+        :param records: :class:`LogRecordBuffer` of the previous engine.
+        """
+        records.extend(self.__log_records)
+        self.__log_records = records
+
     def _emit_log_message_FUTURE(self, handler, record):
         """
         Called by the engine to log messages in Maya script editor.
@@ -545,18 +1095,16 @@ class MayaEngine(tank.platform.Engine):
                                     record.basename,
                                     record.message)
 
-        # Select Maya display function to use according to the logging record level.
-        if record.levelno < logging.WARNING:
-            fct = OpenMaya.MGlobal.displayInfo
-        elif record.levelno < logging.ERROR:
-            fct = OpenMaya.MGlobal.displayWarning
-        else:
-            fct = OpenMaya.MGlobal.displayError
-
         # Display the message in Maya script editor in a thread safe manner.
-        self.async_execute_in_main_thread(fct, msg)
+        self._display_log_message(record.levelno, msg)
+
+    def _refresh_debug_logging(self):
+        """
+        Caches the value of the debug_logging setting.
+        """
+        self._debug_logging = self.get_setting("debug_logging", False)
 
-    def log_debug(self, msg):
+    def log_debug(self, msg, *args):
         """
         Logs debug messages in Maya script editor.
 
@@ -568,19 +1116,36 @@ class MayaEngine(tank.platform.Engine):
                     This message usually has the format "basename: text" where
                     "basename" is the leaf part of the logging record name,
                     for example "tk-multi-shotgunpanel" or "qt_importer".
+        :param args: Arguments merged into the message with the % operator,
+                     only when the message is actually logged. As with the
+                     standard logging module, a single dictionary argument
+                     is merged into the named fields of the message.
         """
 
-        # Do not log debug messages when debug logging setting is off.
-        if not self.get_setting("debug_logging", False):
+        # Do not log debug messages when debug logging setting is off,
+        # unless they are written to the log file.
+        debug_logging = self._debug_logging
+        if debug_logging is None:
+            debug_logging = self.get_setting("debug_logging", False)
+        if not debug_logging and self.__log_file_writer is None:
             return
 
         current_time_stamp = time.time()
 
         # Give a standard format to the message.
-        msg = "Shotgun DEBUG (%0.3fs): %s" % (current_time_stamp-self._debug_msg_time_stamp, msg)
+        if args:
+            if len(args) == 1 and isinstance(args[0], dict):
+                args = args[0]
+            msg = msg % args
+        # The prefix is kept apart, for identical messages to be collapsed in the script editor
+        # whatever the time elapsed since the previous message.
+        prefix = "Shotgun DEBUG (%0.3fs): " % (current_time_stamp-self._debug_msg_time_stamp)
 
         # Display the message in Maya script editor in a thread safe manner.
-        self.async_execute_in_main_thread(OpenMaya.MGlobal.displayInfo, msg)
+        if debug_logging:
+            self._display_log_message(logging.DEBUG, msg, prefix)
+        else:
+            self._record_log_message(logging.DEBUG, prefix + msg)
 
         # Update the debug message time stamp.
         self._debug_msg_time_stamp = current_time_stamp
@@ -603,7 +1168,7 @@ class MayaEngine(tank.platform.Engine):
         msg = "Shotgun: %s" % msg
 
         # Display the message in Maya script editor in a thread safe manner.
-        self.async_execute_in_main_thread(OpenMaya.MGlobal.displayInfo, msg)
+        self._display_log_message(logging.INFO, msg)
 
     def log_warning(self, msg):
         """
@@ -623,7 +1188,7 @@ class MayaEngine(tank.platform.Engine):
         msg = "Shotgun: %s" % msg
 
         # Display the message in Maya script editor in a thread safe manner.
-        self.async_execute_in_main_thread(OpenMaya.MGlobal.displayWarning, msg)
+        self._display_log_message(logging.WARNING, msg)
 
     def log_error(self, msg):
         """
@@ -643,11 +1208,31 @@ class MayaEngine(tank.platform.Engine):
         msg = "Shotgun: %s" % msg
 
         # Display the message in Maya script editor in a thread safe manner.
-        self.async_execute_in_main_thread(OpenMaya.MGlobal.displayError, msg)
+        self._display_log_message(logging.ERROR, msg)
 
     ##########################################################################################
     # scene and project management
 
+    @property
+    def scene_resolver(self):
+        """
+        Resolver of the API instance and context of the scene files opened in Maya,
+        caching its results across scene events.
+        """
+        if self.__scene_resolver is None:
+            tk_maya = self.import_module("tk_maya")
+            self.__scene_resolver = tk_maya.SceneResolver(self)
+        return self.__scene_resolver
+
+    def adopt_scene_resolver(self, resolver):
+        """
+        Takes over the scene resolver of a previous engine instance, along with its caches.
+
+        :param resolver: Scene resolver of the previous engine.
+        """
+        resolver.attach(self)
+        self.__scene_resolver = resolver
+
     def _set_project(self):
         """
         Set the maya project
@@ -660,7 +1245,8 @@ class MayaEngine(tank.platform.Engine):
         fields = self.context.as_template_fields(tmpl)
         proj_path = tmpl.apply_fields(fields)
         self.log_info("Setting Maya project to '%s'" % proj_path)
-        pm.mel.setProject(proj_path)
+        # MEL expects forward slashes, even on Windows
+        mel.eval('setProject "%s"' % proj_path.replace("\\", "/"))
 
     ##########################################################################################
     # panel support
@@ -678,11 +1264,9 @@ class MayaEngine(tank.platform.Engine):
 
         :returns: the created widget_class instance
         """
-        from tank.platform.qt import QtCore, QtGui
-
         tk_maya = self.import_module("tk_maya")
 
-        self.log_debug("Begin showing panel %s" % panel_id)
+        self.log_debug("Begin showing panel %s", panel_id)
 
         # The general approach below is as follows:
         #
@@ -712,33 +1296,35 @@ class MayaEngine(tank.platform.Engine):
         # make a unique id for the app widget based off of the panel id
         widget_id = "wdgt_%s" % panel_id
 
-        if pm.control(widget_id, query=1, exists=1):
-            self.log_debug("Reparent existing toolkit widget %s." % widget_id)
+        if cmds.control(widget_id, query=True, exists=True):
+            self.log_debug("Reparent existing toolkit widget %s.", widget_id)
             # find the widget for later use
-            for widget in QtGui.QApplication.allWidgets():
-                if widget.objectName() == widget_id:
-                    widget_instance = widget
-                    # Reparent the Shotgun app panel widget under Maya main window
-                    # to prevent it from being deleted with the existing Maya panel.
-                    self.log_debug("Reparenting widget %s under Maya main window." % widget_id)
-                    parent = self._get_dialog_parent()
-                    widget_instance.setParent(parent)
-                    break
+            widget_instance = tk_maya.find_widget(widget_id)
+            if widget_instance:
+                # Reparent the Shotgun app panel widget under Maya main window
+                # to prevent it from being deleted with the existing Maya panel.
+                self.log_debug("Reparenting widget %s under Maya main window.", widget_id)
+                parent = self._get_dialog_parent()
+                widget_instance.setParent(parent)
 
         else:
-            self.log_debug("Create toolkit widget %s" % widget_id)
+            self.log_debug("Create toolkit widget %s", widget_id)
             # parent the UI to the main maya window
             parent = self._get_dialog_parent()
             widget_instance = widget_class(*args, **kwargs)
             widget_instance.setParent(parent)
             # set its name - this means that it can also be found via the maya API
             widget_instance.setObjectName(widget_id)
-            self.log_debug("Created widget %s: %s" % (widget_id, widget_instance))
+            # and found without going through all the QT widgets
+            tk_maya.register_widget(widget_instance)
+            self.log_debug("Created widget %s: %s", widget_id, widget_instance)
             # apply external stylesheet
             self._apply_external_styleshet(bundle, widget_instance)
 
         # Dock the app panel widget in a new panel tab of Maya Channel Box dock area.
-        tk_maya.dock_panel(self, panel_id, widget_instance, title)
+        # The Maya panel widget is only weakly registered, keep it referenced
+        # until its event watcher is installed below.
+        panel_widget = tk_maya.dock_panel(self, panel_id, widget_instance, title)
 
         # just like nuke, maya doesn't give us any hints when a panel is being closed.
         # QT widgets contained within this panel are just unparented and the floating
@@ -755,6 +1341,7 @@ class MayaEngine(tank.platform.Engine):
         # resolved by looking at the stream of event and force triggering refreshes at the
         # right locations
         #
-        tk_maya.install_callbacks(panel_id, widget_id)
+        if panel_widget is not None:
+            tk_maya.install_callbacks(panel_widget.objectName(), widget_id)
 
         return widget_instance
@@ -9,5 +9,12 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 from .menu_generation import MenuGenerator
+from .command_registry import CommandRegistry
+from .command_palette import CommandPalette
+from .launch_history import LaunchHistory, find_unloaded_app_modules
+from .scene_resolution import SceneResolver
+from .scheduler import IdleScheduler
+from .script_editor_log import ScriptEditorLog
+from .log_buffer import LogRecordBuffer, LogFileWriter
 from .panel_generation import dock_panel
-from .panel_util import install_callbacks
+from .panel_util import install_callbacks, register_widget, find_widget, get_repaint_counts
@@ -0,0 +1,234 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Quick launch palette to search and run the engine commands from the keyboard.
+"""
+
+from tank.platform.qt import QtCore, QtGui
+
+# characters after which a match counts as the start of a word
+_WORD_SEPARATORS = " /_-.:"
+
+
+class CommandSearchIndex(object):
+    """
+    Fuzzy search index of the commands of a :class:`CommandRegistry`.
+
+    Commands are matched on their name, the display name of their app and
+    their tooltip. The lower case search fields and their character sets are
+    computed once, when the index is built, and the index is only built again
+    when the context or the registered commands change.
+    """
+
+    # weights given to a match in the name, app display name and tooltip fields
+    FIELD_WEIGHTS = (3, 2, 1)
+
+    def __init__(self, registry):
+        """
+        Constructor.
+
+        :param registry: :class:`CommandRegistry` holding the commands to search.
+        """
+        self._registry = registry
+        self._index_key = None
+        # list of (command record, search fields, characters of all fields)
+        self._entries = []
+
+    def refresh(self, context):
+        """
+        Builds the index again if the context or the registered commands changed
+        since it was last built.
+
+        :param context: Current context of the engine.
+        """
+        index_key = (context, self._registry.version)
+        if index_key == self._index_key:
+            return
+
+        self._entries = []
+        for cmd in self._registry.commands:
+            fields = (
+                cmd.name.lower(),
+                (cmd.get_app_name() or "").lower(),
+                (cmd.properties.get("tooltip") or "").lower(),
+            )
+            self._entries.append((cmd, fields, frozenset("".join(fields))))
+        self._index_key = index_key
+
+    def search(self, text, max_results=20):
+        """
+        Searches the index.
+
+        Every whitespace separated term of the text must fuzzy match one of the
+        search fields of a command for the command to be returned.
+
+        :param text: Text to search for.
+        :param max_results: Maximum number of results to return.
+        :returns: List of matching :class:`AppCommand` records, best matches first.
+        """
+        terms = text.lower().split()
+        if not terms:
+            return [cmd for (cmd, _, _) in self._entries[:max_results]]
+
+        query_chars = frozenset("".join(terms))
+        results = []
+        for (cmd, fields, chars) in self._entries:
+            # quickly discard commands missing some of the searched characters
+            if not query_chars <= chars:
+                continue
+            score = 0
+            for term in terms:
+                term_score = None
+                for (field, weight) in zip(fields, self.FIELD_WEIGHTS):
+                    field_score = _fuzzy_score(term, field)
+                    if field_score is not None and (term_score is None or field_score * weight > term_score):
+                        term_score = field_score * weight
+                if term_score is None:
+                    break
+                score += term_score
+            else:
+                results.append((-score, cmd.name, cmd))
+
+        results.sort()
+        return [cmd for (_, _, cmd) in results[:max_results]]
+
+
+def _fuzzy_score(term, text):
+    """
+    Scores how well a term matches a text.
+
+    :param term: Lower case term to look for.
+    :param text: Lower case text to look into.
+    :returns: A positive score, higher for better matches, or None if the characters
+              of the term do not all appear in the text in the same order.
+    """
+    position = text.find(term)
+    if position != -1:
+        # substring match, best when at the start of the text or of a word
+        score = 100 + 10 * len(term)
+        if position == 0 or text[position - 1] in _WORD_SEPARATORS:
+            score += 50
+        return score
+
+    # subsequence match, favouring consecutive characters and word starts
+    score = 1
+    last_position = -1
+    for char in term:
+        position = text.find(char, last_position + 1)
+        if position == -1:
+            return None
+        if position == last_position + 1:
+            score += 5
+        if position == 0 or text[position - 1] in _WORD_SEPARATORS:
+            score += 10
+        last_position = position
+    return score
+
+
+class CommandPalette(QtGui.QDialog):
+    """
+    Frameless dialog listing the commands matching the text typed by the user.
+    The selected command is launched when the user presses enter.
+    """
+
+    def __init__(self, engine, parent=None):
+        """
+        Constructor.
+
+        :param engine: :class:`MayaEngine` instance running in Maya.
+        :param parent: Parent widget of the dialog.
+        """
+        super(CommandPalette, self).__init__(parent)
+        self._engine = engine
+        self._index = CommandSearchIndex(engine.command_registry)
+        # commands currently listed, in row order
+        self._results = []
+
+        self.setWindowTitle("Shotgun Quick Launch")
+        self.setWindowFlags(QtCore.Qt.Popup | QtCore.Qt.FramelessWindowHint)
+        self.setMinimumWidth(480)
+
+        self._search_field = QtGui.QLineEdit(self)
+        self._search_field.setPlaceholderText("Search Shotgun commands...")
+        self._results_list = QtGui.QListWidget(self)
+
+        layout = QtGui.QVBoxLayout(self)
+        layout.setContentsMargins(4, 4, 4, 4)
+        layout.addWidget(self._search_field)
+        layout.addWidget(self._results_list)
+
+        self._search_field.textChanged.connect(self._update_results)
+        self._search_field.returnPressed.connect(self._launch_selected)
+        self._results_list.itemActivated.connect(self._launch_selected)
+        self._search_field.installEventFilter(self)
+
+    def popup(self):
+        """
+        Shows the palette, centered over its parent, with an empty search field.
+        """
+        self._index.refresh(self._engine.context)
+        self._search_field.clear()
+        self._update_results("")
+
+        parent = self.parentWidget()
+        if parent:
+            geometry = self.frameGeometry()
+            geometry.moveCenter(parent.frameGeometry().center())
+            self.move(geometry.topLeft())
+
+        self.show()
+        self.raise_()
+        self.activateWindow()
+        self._search_field.setFocus()
+
+    def eventFilter(self, obj, event):
+        """
+        Lets the user move through the results with the arrow keys
+        while typing in the search field.
+
+        :param obj: The object where the event originated from
+        :param event: The actual event object
+        :returns: True if event was consumed, False if not
+        """
+        if event.type() == QtCore.QEvent.KeyPress and event.key() in (QtCore.Qt.Key_Up, QtCore.Qt.Key_Down):
+            row = self._results_list.currentRow()
+            row += -1 if event.key() == QtCore.Qt.Key_Up else 1
+            if 0 <= row < self._results_list.count():
+                self._results_list.setCurrentRow(row)
+            return True
+        return False
+
+    def _update_results(self, text):
+        """
+        Lists the commands matching the search text.
+
+        :param text: Text typed in the search field.
+        """
+        self._results_list.clear()
+        self._results = self._index.search(text)
+        for cmd in self._results:
+            app_name = cmd.get_app_name()
+            label = "%s  (%s)" % (cmd.name, app_name) if app_name else cmd.name
+            item = QtGui.QListWidgetItem(label, self._results_list)
+            if "tooltip" in cmd.properties:
+                item.setToolTip(cmd.properties["tooltip"])
+        if self._results_list.count():
+            self._results_list.setCurrentRow(0)
+
+    def _launch_selected(self, *args):
+        """
+        Launches the selected command the same way the Shotgun menu does.
+        """
+        row = self._results_list.currentRow()
+        if not 0 <= row < len(self._results):
+            return
+        self.hide()
+        self._results[row]._execute_deferred()
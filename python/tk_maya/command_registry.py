@@ -0,0 +1,221 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Registry of the commands registered with the engine.
+"""
+
+import bisect
+
+from .menu_generation import AppCommand
+
+
+class CommandRegistry(object):
+    """
+    Long lived registry of the :class:`AppCommand` records wrapping the engine commands.
+
+    The records are kept sorted by name, grouped by app and by command type, and
+    indexed by app instance. The registry is synchronized incrementally with the
+    engine commands: only the records of the commands which were added, removed
+    or re-registered since the last synchronization are updated.
+    """
+
+    # name of the group holding the commands which do not belong to an app
+    OTHER_ITEMS = "Other Items"
+
+    def __init__(self, engine):
+        """
+        Constructor.
+
+        :param engine: :class:`MayaEngine` instance running in Maya.
+        """
+        self._engine = engine
+        self._dirty = True
+        self._sync_key = None
+        # app objects mapped to their instance name
+        self._app_instance_names = {}
+        # records keyed by command name, and sorted command names
+        self._commands = {}
+        self._names = []
+        # sorted records of the context menu commands,
+        # and of the other commands grouped by app name
+        self._context_menu_commands = []
+        self._commands_by_app = {}
+        # records keyed by command name, grouped by app instance name
+        self._commands_by_app_instance = {}
+        # incremented every time the registry content changes
+        self._version = 0
+
+    @property
+    def version(self):
+        """
+        Number incremented every time commands are added to or removed from the registry.
+        """
+        self.sync()
+        return self._version
+
+    @property
+    def commands(self):
+        """
+        List of all the :class:`AppCommand` records, sorted by name.
+        """
+        self.sync()
+        return [self._commands[name] for name in self._names]
+
+    @property
+    def context_menu_commands(self):
+        """
+        List of the context menu :class:`AppCommand` records, sorted by name.
+        This list is owned by the registry and must not be modified.
+        """
+        self.sync()
+        return self._context_menu_commands
+
+    @property
+    def commands_by_app(self):
+        """
+        Dictionary of the :class:`AppCommand` records, other than the context menu ones,
+        keyed by app display name. The records of each app are sorted by name.
+        This dictionary is owned by the registry and must not be modified.
+        """
+        self.sync()
+        return self._commands_by_app
+
+    def get_app_instance_commands(self, app_instance_name):
+        """
+        Returns the commands registered by an app instance.
+
+        :param app_instance_name: Name of the app instance, as defined in the environment.
+        :returns: Dictionary of :class:`AppCommand` records keyed by command name,
+                  or None if the app instance did not register any command.
+        """
+        self.sync()
+        return self._commands_by_app_instance.get(app_instance_name)
+
+    def find_command(self, app_instance_name, command_name):
+        """
+        Finds a command registered by an app instance.
+
+        :param app_instance_name: Name of the app instance, as defined in the environment.
+        :param command_name: Name of the command.
+        :returns: The :class:`AppCommand` record or None if not found.
+        """
+        commands = self.get_app_instance_commands(app_instance_name)
+        if commands is None:
+            return None
+        return commands.get(command_name)
+
+    def invalidate(self):
+        """
+        Flags the registry as needing a full comparison with the engine commands
+        on its next synchronization, for example after a command was registered.
+        """
+        self._dirty = True
+
+    def sync(self):
+        """
+        Synchronizes the registry with the engine apps and commands.
+        """
+        engine_apps = self._engine.apps
+        engine_commands = self._engine.commands
+
+        # when no command was registered and no app or command was removed,
+        # the registry is already up to date
+        sync_key = (len(engine_apps), len(engine_commands))
+        if not self._dirty and sync_key == self._sync_key:
+            return
+
+        app_instance_names = dict(
+            (app_instance_obj, app_instance_name)
+            for (app_instance_name, app_instance_obj) in engine_apps.iteritems()
+        )
+        if app_instance_names != self._app_instance_names:
+            # apps changed, so all the records must be checked against their app
+            self._app_instance_names = app_instance_names
+            for name in self._commands.keys():
+                self._remove(name)
+
+        # remove the records of the commands which are gone
+        for name in self._commands.keys():
+            if name not in engine_commands:
+                self._remove(name)
+
+        # add the records of the new commands and of the commands which were re-registered
+        for (name, command_dict) in engine_commands.iteritems():
+            record = self._commands.get(name)
+            if record is not None:
+                if (record.callback is command_dict["callback"] and
+                        record.properties is command_dict["properties"]):
+                    continue
+                self._remove(name)
+            self._add(name, command_dict)
+
+        self._dirty = False
+        self._sync_key = sync_key
+
+    def _add(self, name, command_dict):
+        """
+        Adds a new record to the registry.
+
+        :param name: Name of the command.
+        :param command_dict: Command dictionary, as found in the engine commands.
+        """
+        app_instance_name = self._app_instance_names.get(command_dict["properties"].get("app"))
+        record = AppCommand(name, command_dict, app_instance_name)
+
+        self._commands[name] = record
+        bisect.insort(self._names, name)
+
+        group = self._get_group(record, create=True)
+        names = [cmd.name for cmd in group]
+        group.insert(bisect.bisect(names, name), record)
+
+        if app_instance_name:
+            self._commands_by_app_instance.setdefault(app_instance_name, {})[name] = record
+
+        self._version += 1
+
+    def _remove(self, name):
+        """
+        Removes a record from the registry.
+
+        :param name: Name of the command.
+        """
+        record = self._commands.pop(name)
+        del self._names[bisect.bisect_left(self._names, name)]
+
+        group = self._get_group(record)
+        group.remove(record)
+        if not group and group is not self._context_menu_commands:
+            del self._commands_by_app[record.get_app_name() or self.OTHER_ITEMS]
+
+        instance_commands = self._commands_by_app_instance.get(record.get_app_instance_name())
+        if instance_commands is not None:
+            instance_commands.pop(name, None)
+            if not instance_commands:
+                del self._commands_by_app_instance[record.get_app_instance_name()]
+
+        self._version += 1
+
+    def _get_group(self, record, create=False):
+        """
+        Returns the sorted list of records a record belongs to.
+
+        :param record: :class:`AppCommand` record.
+        :param create: If True, creates the list of an app when it does not exist yet.
+        :returns: List of :class:`AppCommand` records.
+        """
+        if record.get_type() == "context_menu":
+            return self._context_menu_commands
+
+        app_name = record.get_app_name() or self.OTHER_ITEMS
+        if create:
+            return self._commands_by_app.setdefault(app_name, [])
+        return self._commands_by_app[app_name]
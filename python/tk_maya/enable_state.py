@@ -0,0 +1,181 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Caching of the enabled state of menu commands.
+"""
+
+import time
+
+
+class EnableStateCache(object):
+    """
+    Caches the result of the command enable callbacks for the current context.
+
+    Each callback has its own time budget. A callback which returned within its
+    budget the last time it was called is simply called again, so that its state
+    is always up to date. A callback which was never called, or which exceeded
+    its budget, is not called while the menu is built: its last known state, or
+    enabled when it has none, is returned right away and the callback is evaluated
+    once the event loop gets control back. Listeners are notified when such an
+    evaluation changes the state shown for a command.
+    """
+
+    def __init__(self, engine, time_budget):
+        """
+        Constructor.
+
+        :param engine: :class:`MayaEngine` instance running in Maya.
+        :param time_budget: Default time in seconds an enable callback can take before
+                            its evaluation is moved off the menu build.
+        """
+        self._engine = engine
+        self._time_budget = time_budget
+        self._context = None
+        # last known enabled state, keyed by command name
+        self._states = {}
+        # last evaluation time, keyed by command name, kept when states are discarded
+        # since it tells how slow the callback is rather than what it returned
+        self._durations = {}
+        # (callback, time budget) tuples waiting for a deferred evaluation, keyed by command name
+        self._pending = {}
+        # evaluation statistics keyed by command name: [count, total time, max time]
+        self._timings = {}
+        self._listeners = []
+
+    @property
+    def timings(self):
+        """
+        Dictionary of evaluation statistics keyed by command name.
+
+        Each value is a dictionary with keys ``count``, ``total`` and ``max``,
+        the times being expressed in seconds.
+        """
+        return dict(
+            (name, {"count": count, "total": total, "max": max_time})
+            for (name, (count, total, max_time)) in self._timings.iteritems()
+        )
+
+    def add_listener(self, listener):
+        """
+        Registers a callable notified when a deferred evaluation changes the
+        state shown for a command.
+
+        :param listener: Callable accepting a command name and its new enabled state.
+        """
+        self._listeners.append(listener)
+
+    def set_context(self, context):
+        """
+        Sets the context the cached states are valid for.
+        Cached states are discarded when the context changes.
+
+        :param context: Current context of the engine.
+        """
+        if context != self._context:
+            self.invalidate()
+            self._context = context
+
+    def invalidate(self, command_name=None):
+        """
+        Discards cached states.
+
+        :param command_name: Name of the command whose state should be discarded,
+                             or None to discard all states.
+        """
+        if command_name is None:
+            self._states = {}
+            self._pending = {}
+        else:
+            self._states.pop(command_name, None)
+            self._pending.pop(command_name, None)
+
+    def get_state(self, command_name, callback, time_budget=None):
+        """
+        Returns the enabled state of a command.
+
+        :param command_name: Name of the command.
+        :param callback: Enable callback of the command.
+        :param time_budget: Time in seconds the callback can take while the menu is built,
+                            None for the default budget.
+        :returns: True if the command should be enabled, False otherwise.
+        """
+        if time_budget is None:
+            time_budget = self._time_budget
+
+        duration = self._durations.get(command_name)
+        if duration is None or duration > time_budget:
+            # this callback may be too slow to be called while the menu is built,
+            # use its last known state and evaluate it later on
+            if command_name not in self._pending:
+                self._pending[command_name] = (callback, time_budget)
+                scheduler = self._engine.scheduler
+                scheduler.schedule(scheduler.PRIORITY_LOW, self._evaluate_pending, command_name)
+            return self._states.get(command_name, True)
+
+        return self._evaluate(command_name, callback, time_budget)
+
+    def _evaluate(self, command_name, callback, time_budget):
+        """
+        Calls an enable callback, caches its result and records how long it took.
+
+        :param command_name: Name of the command.
+        :param callback: Enable callback of the command.
+        :param time_budget: Time in seconds the callback can take while the menu is built.
+        :returns: The enabled state returned by the callback.
+        """
+        start_time = time.time()
+        state = callback()
+        duration = time.time() - start_time
+
+        self._states[command_name] = state
+        self._durations[command_name] = duration
+
+        timing = self._timings.setdefault(command_name, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += duration
+        timing[2] = max(timing[2], duration)
+
+        if duration > time_budget:
+            self._engine.log_debug(
+                "Enable callback of command '%s' took %0.3fs, over its %0.3fs budget.",
+                command_name, duration, time_budget
+            )
+
+        return state
+
+    def _evaluate_pending(self, command_name):
+        """
+        Evaluates the enable callback of a command off the menu build and notifies
+        the listeners if the state shown for the command changed.
+
+        :param command_name: Name of the command.
+        """
+        if self._engine.destroyed:
+            # the engine was destroyed since the evaluation was scheduled
+            return
+
+        pending = self._pending.pop(command_name, None)
+        if pending is None:
+            # the state was discarded since the evaluation was scheduled
+            return
+
+        (callback, time_budget) = pending
+        shown_state = self._states.get(command_name, True)
+        try:
+            state = self._evaluate(command_name, callback, time_budget)
+        except Exception:
+            self._engine.log_exception(
+                "Enable callback of command '%s' raised an exception." % command_name
+            )
+            return
+        if state != shown_state:
+            for listener in self._listeners:
+                listener(command_name, state)
@@ -0,0 +1,149 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+History of the commands launched by the user, and warm up of the apps they belong to.
+"""
+
+import os
+import sys
+import json
+import time
+import pkgutil
+
+
+class LaunchHistory(object):
+    """
+    Launch counts and latencies of the commands, persisted in a json file.
+
+    Commands are identified by the name of the app instance which registered
+    them and by their name, so that the history carries over Maya sessions.
+    """
+
+    def __init__(self, engine, path):
+        """
+        Constructor.
+
+        :param engine: :class:`MayaEngine` instance running in Maya.
+        :param path: Path of the json file the history is stored in.
+        """
+        self._engine = engine
+        self._path = path
+        # dictionaries with keys count, total_time and last_launch,
+        # keyed by "app instance name/command name"
+        self._history = {}
+        # set while a save of the history is scheduled
+        self._save_scheduled = False
+        self._load()
+
+    def record(self, app_instance_name, command_name, duration):
+        """
+        Records a command launch and schedules a save of the history.
+
+        :param app_instance_name: Name of the app instance which registered the command.
+        :param command_name: Name of the command.
+        :param duration: Time in seconds the command callback took to return.
+        """
+        key = "%s/%s" % (app_instance_name, command_name)
+        entry = self._history.setdefault(key, {"count": 0, "total_time": 0.0, "last_launch": 0})
+        entry["count"] += 1
+        entry["total_time"] += duration
+        entry["last_launch"] = time.time()
+
+        self._engine.log_debug(
+            "Command '%s' of app '%s' took %0.3fs to launch (launched %d times, %0.3fs on average).",
+            command_name, app_instance_name, duration, entry["count"], entry["total_time"] / entry["count"]
+        )
+        if not self._save_scheduled:
+            # the launches recorded until Maya is idle are saved at once
+            self._save_scheduled = True
+            scheduler = self._engine.scheduler
+            scheduler.schedule(scheduler.PRIORITY_LOW, self.flush)
+
+    def flush(self):
+        """
+        Saves the history if launches were recorded since it was last saved.
+        """
+        if self._save_scheduled:
+            self._save_scheduled = False
+            self._save()
+
+    def most_used_app_instances(self, max_count):
+        """
+        Returns the app instances whose commands were launched the most.
+
+        :param max_count: Maximum number of app instance names to return.
+        :returns: List of app instance names, most used first.
+        """
+        counts = {}
+        for (key, entry) in self._history.iteritems():
+            app_instance_name = key.split("/", 1)[0]
+            counts[app_instance_name] = counts.get(app_instance_name, 0) + entry["count"]
+        return sorted(counts, key=lambda name: counts[name], reverse=True)[:max_count]
+
+    def _load(self):
+        """
+        Loads the history from disk, starting with an empty history when it cannot be read.
+        """
+        if not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, "r") as history_file:
+                self._history = json.load(history_file)
+        except Exception, e:
+            self._engine.log_debug("Could not read launch history %s: %s", self._path, e)
+            self._history = {}
+
+    def _save(self):
+        """
+        Writes the history to disk, replacing the previous file only once fully written.
+        """
+        tmp_path = "%s.tmp" % self._path
+        try:
+            folder = os.path.dirname(self._path)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(tmp_path, "w") as history_file:
+                json.dump(self._history, history_file)
+            if sys.platform == "win32" and os.path.exists(self._path):
+                # rename does not replace existing files on Windows
+                os.remove(self._path)
+            os.rename(tmp_path, self._path)
+        except Exception, e:
+            self._engine.log_debug("Could not write launch history %s: %s", self._path, e)
+
+
+def find_unloaded_app_modules(app):
+    """
+    Finds the modules of an app which have not been imported yet.
+
+    Apps import their python package when they initialize, but usually only
+    import the modules holding their dialogs and widgets when a command is
+    launched. This returns the names of these modules, so that they can be
+    imported ahead of time.
+
+    :param app: App object running in the engine.
+    :returns: List of module names.
+    """
+    python_folder = os.path.normcase(os.path.join(app.disk_location, "python"))
+
+    module_names = []
+    for (name, module) in sys.modules.items():
+        # only consider the packages loaded from the app python folder
+        path = getattr(module, "__path__", None)
+        module_file = getattr(module, "__file__", None)
+        if not path or not module_file or not os.path.normcase(module_file).startswith(python_folder):
+            continue
+        for (_, sub_module_name, _) in pkgutil.iter_modules(path):
+            full_name = "%s.%s" % (name, sub_module_name)
+            if full_name not in sys.modules:
+                module_names.append(full_name)
+
+    return sorted(module_names)
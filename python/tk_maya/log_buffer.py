@@ -0,0 +1,202 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+In memory buffer and log file of the engine log messages.
+"""
+
+import os
+import Queue
+import logging
+import threading
+import collections
+import logging.handlers
+
+# format of the log messages, in the log file and when the buffer is dumped
+_LOG_FORMAT = "%(asctime)s %(levelname)-7s [%(threadName)s] %(message)s"
+
+
+class LogRecordBuffer(object):
+    """
+    Bounded buffer of the most recent log records, the oldest records being
+    discarded as new ones are added.
+    """
+
+    def __init__(self, max_records):
+        """
+        Constructor.
+
+        :param max_records: Maximum number of records to keep.
+        """
+        self._records = collections.deque(maxlen=max_records)
+
+    def add(self, record):
+        """
+        Adds a record to the buffer. This can be called from any thread.
+
+        :param record: Standard python logging record.
+        """
+        self._records.append(record)
+
+    def extend(self, records):
+        """
+        Adds records to the buffer, after the ones it already holds.
+
+        :param records: :class:`LogRecordBuffer` whose records to add.
+        """
+        self._records.extend(list(records._records))
+
+    def dump(self, path):
+        """
+        Writes the records of the buffer to a file.
+
+        :param path: Path of the file to write.
+        """
+        formatter = logging.Formatter(_LOG_FORMAT)
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(path, "w") as dump_file:
+            for record in list(self._records):
+                dump_file.write(formatter.format(record) + "\n")
+
+
+class LogFileWriter(object):
+    """
+    Rotating log file written by a background thread, so that logging
+    to disk never holds up the thread logging the messages.
+
+    The writer thread is handed over from engine to engine: a writer created
+    for a log file which a running thread writes already queues its records
+    to this thread, rather than opening the file a second time, which would
+    make two handlers race when the file is rotated. The thread stops once
+    all the writers sharing it are closed.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor.
+
+        :param path: Path of the log file.
+        """
+        self._path = path
+        self._thread = _LogFileWriterThread.acquire(path)
+        self._closed = False
+
+    @property
+    def path(self):
+        """
+        Path of the log file.
+        """
+        return self._path
+
+    def write(self, record):
+        """
+        Queues a record to be written to the log file. This can be called from any thread.
+
+        :param record: Standard python logging record.
+        """
+        self._thread.records.put(record)
+
+    def close(self):
+        """
+        Closes the log file once the queued records are written, unless another writer
+        shares it. This returns right away, the records being written by the writer
+        thread in the background.
+        """
+        if not self._closed:
+            self._closed = True
+            self._thread.release()
+
+
+class _LogFileWriterThread(threading.Thread):
+    """
+    Thread writing the records queued by the writers of a log file.
+
+    Running threads are found through :func:`threading.enumerate`, since this
+    module is imported again by each new engine instance. They are accessed
+    through their attributes only, their class being different from one
+    import of this module to the next.
+    """
+
+    NAME = "tk-maya log file writer"
+
+    # maximum size in bytes of a log file before it is rotated
+    MAX_BYTES = 5 * 1024 * 1024
+    # number of rotated log files to keep
+    BACKUP_COUNT = 5
+
+    def __init__(self, path):
+        """
+        Constructor.
+
+        :param path: Path of the log file.
+        """
+        threading.Thread.__init__(self, name=self.NAME)
+        self.daemon = True
+        self.path = path
+        self.records = Queue.Queue()
+        # guards the number of writers using the thread and its finished state
+        self.lock = threading.Lock()
+        self.writer_count = 1
+        self.finished = False
+
+    @classmethod
+    def acquire(cls, path):
+        """
+        Returns the thread writing a log file, starting it if no thread writes this file.
+
+        :param path: Path of the log file.
+        :returns: Thread object with ``records``, ``lock`` and ``release`` members.
+        """
+        for thread in threading.enumerate():
+            if thread.name != cls.NAME or getattr(thread, "path", None) != path:
+                continue
+            with thread.lock:
+                if not thread.finished:
+                    thread.writer_count += 1
+                    return thread
+        thread = cls(path)
+        thread.start()
+        return thread
+
+    def release(self):
+        """
+        Stops the thread once the queued records are written, if no other writer uses it.
+        """
+        with self.lock:
+            self.writer_count -= 1
+            if not self.writer_count:
+                self.records.put(None)
+
+    def run(self):
+        """
+        Writes the queued records until all the writers are closed.
+        """
+        folder = os.path.dirname(self.path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        handler = logging.handlers.RotatingFileHandler(
+            self.path, maxBytes=self.MAX_BYTES, backupCount=self.BACKUP_COUNT
+        )
+        handler.setFormatter(logging.Formatter(_LOG_FORMAT))
+        while True:
+            record = self.records.get()
+            if record is not None:
+                handler.emit(record)
+                continue
+            with self.lock:
+                if self.writer_count:
+                    # a writer took the thread over after the last one was closed
+                    continue
+                # the file is closed before a new thread can be started for it
+                handler.close()
+                self.finished = True
+                return
@@ -16,13 +16,14 @@ Menu handling for Maya
 import tank
 import sys
 import os
+import time
 import unicodedata
 import maya.OpenMaya as OpenMaya
-import pymel.core as pm
 import maya.cmds as cmds
 import maya
 from tank.platform.qt import QtGui, QtCore
-from pymel.core import Callback
+
+from .enable_state import EnableStateCache
 
 
 class MenuGenerator(object):
@@ -34,74 +35,127 @@ class MenuGenerator(object):
         self._engine = engine
         self._menu_handle = menu_handle
         self._dialogs = []
+        # top level menu items built the last time the menu was rendered
+        self._menu_items = []
+        # sub-menus created while describing the menu, keyed by (parent node, label)
+        self._sub_menus = {}
+        # enabled state of the commands, the time budget setting is in milliseconds
+        time_budget = self._engine.get_setting("enable_callback_time_budget", 50) / 1000.0
+        self._enable_states = EnableStateCache(engine, time_budget)
+        self._enable_states.add_listener(self._on_enable_state_changed)
+        # number of Maya menu items created, edited or deleted by the current rendering
+        self._num_changes = 0
+        self._menu_stats = {"prebuilds": 0, "reused": 0, "rebuilt": 0}
+
+    @property
+    def enable_states(self):
+        """
+        :class:`EnableStateCache` holding the enabled state of the menu commands.
+        """
+        return self._enable_states
 
     ##########################################################################################
     # public methods
 
     def create_menu(self, *args):
+        """
+        Render the entire Shotgun menu when the user opens it.
+
+        Since the menu is usually prebuilt, this only has to apply the changes
+        which happened since it was last rendered.
+        """
+        if self._render_menu():
+            self._menu_stats["rebuilt"] += 1
+        else:
+            self._menu_stats["reused"] += 1
+        self._engine.log_debug(
+            "Shotgun menu opened, reused %(reused)d and rebuilt %(rebuilt)d times, "
+            "prebuilt %(prebuilds)d times since the engine started.",
+            self._menu_stats
+        )
+
+    def prebuild_menu(self):
+        """
+        Render the entire Shotgun menu ahead of the user opening it.
+        This is meant to be called when Maya is idle.
+        """
+        if self._engine.destroyed:
+            # the engine was torn down in the meantime, and the menu
+            # with the same name may belong to the next engine
+            return
+        self._render_menu()
+        self._menu_stats["prebuilds"] += 1
+
+    ##########################################################################################
+    # menu rendering
+
+    def _render_menu(self):
         """
         Render the entire Shotgun menu.
-        In order to have commands enable/disable themselves based on the enable_callback, 
-        re-create the menu items every time.
+
+        The menu content is first described as a tree of :class:`MenuItemNode` objects.
+        This tree is then compared with the one built the previous time the menu was
+        rendered, so that only the Maya menu items whose label, tooltip, enabled state
+        or position actually changed are added, removed or updated.
+
+        :returns: The number of Maya menu items created, edited or deleted.
         """
-        self._menu_handle.deleteAllItems()
-        
-        # now add the context item on top of the main menu
-        self._context_menu = self._add_context_menu()
-        pm.menuItem(divider=True, parent=self._menu_handle)
+        self._num_changes = 0
 
+        # the menu may have been emptied behind our back, in which case
+        # everything needs to be built again from scratch
+        num_items = cmds.menu(self._menu_handle, query=True, numberOfItems=True) or 0
+        if num_items != len(self._menu_items):
+            cmds.menu(self._menu_handle, edit=True, deleteAllItems=True)
+            self._menu_items = []
 
-        # now enumerate all items and create menu objects for them
-        menu_items = []
-        for (cmd_name, cmd_details) in self._engine.commands.items():
-             menu_items.append( AppCommand(cmd_name, cmd_details) )
+        root = MenuItemNode(None, sub_menu=True)
+        self._sub_menus = {}
+        self._enable_states.set_context(self._engine.context)
 
-        # sort list of commands in name order
-        menu_items.sort(key=lambda x: x.name) 
+        # now add the context item on top of the main menu
+        context_menu = self._add_context_menu(root)
+        root.add_child(MenuItemNode("divider:context", divider=True))
+
+        # the command registry keeps the commands sorted in name order,
+        # and separated out into the context menu ones and the ones of each app
+        registry = self._engine.command_registry
 
         # now add favourites
+        favourites = set()
         for fav in self._engine.get_setting("menu_favourites"):
             app_instance_name = fav["app_instance"]
             menu_name = fav["name"]
-            # scan through all menu items
-            for cmd in menu_items:                 
-                 if cmd.get_app_instance_name() == app_instance_name and cmd.name == menu_name:
-                     # found our match!
-                     cmd.add_command_to_menu(self._menu_handle)
-                     # mark as a favourite item
-                     cmd.favourite = True
-
-        pm.menuItem(divider=True, parent=self._menu_handle)
-        
-        # now go through all of the menu items.
-        # separate them out into various sections
-        commands_by_app = {}
-        
-        for cmd in menu_items:
-
-            if cmd.get_type() == "context_menu":
-                # context menu!
-                cmd.add_command_to_menu(self._context_menu)             
-                
-            else:
-                # normal menu
-                app_name = cmd.get_app_name()
-                if app_name is None:
-                    # un-parented app
-                    app_name = "Other Items" 
-                if not app_name in commands_by_app:
-                    commands_by_app[app_name] = []
-                commands_by_app[app_name].append(cmd)
+            # look up the command registered by the app instance
+            cmd = registry.find_command(app_instance_name, menu_name)
+            if cmd is not None:
+                # found our match!
+                cmd.add_command_to_menu(root, self._sub_menus, self._enable_states)
+                # mark as a favourite item
+                favourites.add(menu_name)
+
+        root.add_child(MenuItemNode("divider:favourites", divider=True))
+
+        # context menu!
+        for cmd in registry.context_menu_commands:
+            cmd.add_command_to_menu(context_menu, self._sub_menus, self._enable_states)
         
         # now add all apps to main menu
-        self._add_app_menu(commands_by_app)
+        self._add_app_menu(root, registry.commands_by_app, favourites)
+
+        # finally, apply the differences with the previous menu to the Maya menu
+        self._menu_items = self._reconcile(self._menu_handle, self._menu_items, root.children)
+        return self._num_changes
         
     ##########################################################################################
     # context menu and UI
 
-    def _add_context_menu(self):
+    def _add_context_menu(self, parent):
         """
         Adds a context menu which displays the current context
+
+        :param parent: :class:`MenuItemNode` to add the context menu to.
+        :returns: The :class:`MenuItemNode` of the context menu.
         """        
         
         ctx = self._engine.context
@@ -110,19 +164,23 @@ class MenuGenerator(object):
         # create the menu object
         # the label expects a unicode object so we cast it to support when the context may 
         # contain info with non-ascii characters
-        ctx_menu = pm.subMenuItem(label=ctx_name.decode("utf-8"), parent=self._menu_handle)
+        ctx_menu = parent.add_child(
+            MenuItemNode("context", label=ctx_name.decode("utf-8"), sub_menu=True)
+        )
 
         # link to UI
-        pm.menuItem(label="Jump to Shotgun", 
-                    parent=ctx_menu, 
-                    command=Callback(self._jump_to_sg))
-        pm.menuItem(label="Jump to File System", 
-                    parent=ctx_menu, 
-                    command=Callback(self._jump_to_fs))
-
+        ctx_menu.add_child(MenuItemNode("jump_to_sg", label="Jump to Shotgun", command=self._jump_to_sg))
+        ctx_menu.add_child(MenuItemNode("jump_to_fs", label="Jump to File System", command=self._jump_to_fs))
+        ctx_menu.add_child(MenuItemNode("quick_launch", label="Quick Launch...",
+                                        command=self._engine.show_command_palette,
+                                        annotation="Search and launch Shotgun commands from the keyboard."))
+        ctx_menu.add_child(MenuItemNode("dump_log", label="Save Recent Log Messages",
+                                        command=self._engine.dump_log_records,
+                                        annotation="Write the recent Shotgun log messages to a file, "
+                                                   "for example to send them to support."))
 
         # divider (apps may register entries below this divider)
-        pm.menuItem(divider=True, parent=ctx_menu)
+        ctx_menu.add_child(MenuItemNode("divider:jump", divider=True))
         
         return ctx_menu
                         
@@ -165,24 +223,26 @@ class MenuGenerator(object):
     # app menus
         
         
-    def _add_app_menu(self, commands_by_app):
+    def _add_app_menu(self, parent, commands_by_app, favourites):
         """
         Add all apps to the main menu, process them one by one.
+
+        :param parent: :class:`MenuItemNode` of the main menu.
+        :param commands_by_app: Dictionary of :class:`AppCommand` lists sorted by name,
+                                keyed by app name.
+        :param favourites: Set of the command names already added as favourites.
         """
         for app_name in sorted(commands_by_app.keys()):
             
             if len(commands_by_app[app_name]) > 1:
                 # more than one menu entry fort his app
-                # make a sub menu and put all items in the sub menu
-                app_menu = pm.subMenuItem(label=app_name, parent=self._menu_handle)                
-                
-                # get the list of menu cmds for this app
-                cmds = commands_by_app[app_name]
-                # make sure it is in alphabetical order
-                cmds.sort(key=lambda x: x.name) 
-                
-                for cmd in cmds:
-                    cmd.add_command_to_menu(app_menu)
+                # make a sub menu which will be populated with all the
+                # items the first time the user opens it
+                populate = lambda name=app_name, commands=commands_by_app[app_name]: \
+                    self._describe_app_menu(name, commands)
+                parent.add_child(
+                    MenuItemNode("app:%s" % app_name, label=app_name, sub_menu=True, populate=populate)
+                )
             
             else:
 
@@ -191,9 +251,248 @@ class MenuGenerator(object):
                 # todo: Should this be labelled with the name of the app 
                 # or the name of the menu item? Not sure.
                 cmd_obj = commands_by_app[app_name][0]
-                if not cmd_obj.favourite:
+                if cmd_obj.name not in favourites:
                     # skip favourites since they are alreay on the menu
-                    cmd_obj.add_command_to_menu(self._menu_handle)
+                    cmd_obj.add_command_to_menu(parent, self._sub_menus, self._enable_states)
+
+    def _describe_app_menu(self, app_name, commands):
+        """
+        Describe the items of an app sub-menu.
+
+        :param app_name: Name of the app.
+        :param commands: List of the :class:`AppCommand` of the app, sorted by name.
+        :returns: List of :class:`MenuItemNode` to populate the app sub-menu with.
+        """
+        app_menu = MenuItemNode("app:%s" % app_name, label=app_name, sub_menu=True)
+        sub_menus = {}
+        for cmd in commands:
+            cmd.add_command_to_menu(app_menu, sub_menus, self._enable_states)
+        return app_menu.children
+
+    ##########################################################################################
+    # incremental menu update
+
+    def _reconcile(self, parent, built_nodes, new_nodes):
+        """
+        Update the Maya menu items under a parent menu so that they match a new description.
+
+        Items present in both descriptions are kept and only edited when their label,
+        tooltip or enabled state changed. Items which are gone are deleted and new items
+        are inserted at their position.
+
+        :param parent: Maya menu or sub-menu item the items belong to.
+        :param built_nodes: List of :class:`MenuItemNode` currently built under the parent.
+        :param new_nodes: List of :class:`MenuItemNode` describing the wanted items.
+        :returns: List of :class:`MenuItemNode` now built under the parent.
+        """
+        built_by_key = dict((node.key, node) for node in built_nodes)
+        new_by_key = dict((node.key, node) for node in new_nodes)
+
+        # delete the items which are not wanted anymore or which changed kind
+        kept_keys = []
+        for node in built_nodes:
+            new_node = new_by_key.get(node.key)
+            if new_node is None or new_node.kind != node.kind:
+                self._delete_item(node)
+            else:
+                kept_keys.append(node.key)
+
+        # the items which are kept must still be in the same relative order,
+        # otherwise they all have to be re-created at their new position
+        kept_set = set(kept_keys)
+        if kept_keys != [node.key for node in new_nodes if node.key in kept_set]:
+            for key in kept_keys:
+                self._delete_item(built_by_key[key])
+            kept_set = set()
+
+        nodes = []
+        previous = None
+        for new_node in new_nodes:
+            if new_node.key in kept_set:
+                node = built_by_key[new_node.key]
+                self._update_item(node, new_node)
+            else:
+                node = new_node
+                self._create_item(parent, node, previous)
+            nodes.append(node)
+            previous = node
+
+        return nodes
+
+    def _create_item(self, parent, node, previous):
+        """
+        Create the Maya menu item for a node, and all its children if it is a sub-menu.
+
+        :param parent: Maya menu or sub-menu item to create the item in.
+        :param node: :class:`MenuItemNode` to create the Maya menu item for.
+        :param previous: :class:`MenuItemNode` the item should be inserted after,
+                         or None to insert it as the first item of the parent.
+        """
+        params = {
+            "parent": parent,
+            # an empty string inserts the item at the top of the menu
+            "insertAfter": previous.path.split("|")[-1] if previous else "",
+        }
+        if node.divider:
+            params["divider"] = True
+        else:
+            params["label"] = node.label
+            params["enable"] = node.enable
+            if node.annotation:
+                params["annotation"] = node.annotation
+            if node.sub_menu:
+                params["subMenu"] = True
+                if node.populate:
+                    # the sub-menu items are only created when the user opens it
+                    params["postMenuCommand"] = lambda *args: self._populate_sub_menu(node)
+            else:
+                params["command"] = lambda *args: node.execute()
+
+        node.path = cmds.menuItem(**params)
+        self._num_changes += 1
+
+        if node.sub_menu and not node.populate:
+            children = node.children
+            node.children = []
+            node.children = self._reconcile(node.path, [], children)
+
+    def _update_item(self, node, new_node):
+        """
+        Update an already built node, and its Maya menu item, with a new description.
+
+        :param node: :class:`MenuItemNode` currently built.
+        :param new_node: :class:`MenuItemNode` describing the wanted item.
+        """
+        edits = {}
+        if not node.divider:
+            if node.label != new_node.label:
+                edits["label"] = new_node.label
+            if node.annotation != new_node.annotation:
+                edits["annotation"] = new_node.annotation or ""
+            if node.enable != new_node.enable:
+                edits["enable"] = new_node.enable
+        if edits:
+            cmds.menuItem(node.path, edit=True, **edits)
+            self._num_changes += 1
+
+        node.label = new_node.label
+        node.annotation = new_node.annotation
+        node.enable = new_node.enable
+        # the Maya menu item calls back into the built node,
+        # so the command can be swapped without touching the item
+        node.command = new_node.command
+        node.populate = new_node.populate
+
+        if node.sub_menu and not node.populate:
+            node.children = self._reconcile(node.path, node.children, new_node.children)
+
+    def _populate_sub_menu(self, node):
+        """
+        Create or update the items of a sub-menu which is populated when opened.
+        The items built the previous time the sub-menu was opened are kept, and
+        only the ones which changed since then are updated.
+
+        :param node: Sub-menu :class:`MenuItemNode` being opened.
+        """
+        if node.path is None or node.populate is None:
+            # the sub-menu was deleted or is not populated on demand anymore
+            return
+        node.children = self._reconcile(node.path, node.children, node.populate())
+
+    def _on_enable_state_changed(self, command_name, enable):
+        """
+        Updates the menu items of a command whose enabled state changed
+        after the menu was built.
+
+        :param command_name: Name of the command.
+        :param enable: New enabled state of the command.
+        """
+        key = "command:%s" % command_name
+        nodes = list(self._menu_items)
+        while nodes:
+            node = nodes.pop()
+            if node.key == key and node.path and node.enable != enable:
+                cmds.menuItem(node.path, edit=True, enable=enable)
+                node.enable = enable
+            nodes.extend(node.children)
+
+    def _delete_item(self, node):
+        """
+        Delete the Maya menu item of a node, along with all its children.
+
+        :param node: :class:`MenuItemNode` to delete.
+        """
+        if cmds.menuItem(node.path, exists=True):
+            cmds.deleteUI(node.path, menuItem=True)
+            self._num_changes += 1
+        node.path = None
+
+
+class MenuItemNode(object):
+    """
+    Describes a single Maya menu item, and remembers the Maya
+    menu item which was built from this description.
+    """
+
+    def __init__(self, key, label=None, sub_menu=False, divider=False,
+                 command=None, annotation=None, enable=True, populate=None):
+        """
+        Constructor.
+
+        :param key: String uniquely identifying the item amongst its siblings.
+        :param label: Label of the menu item.
+        :param sub_menu: True if the item is a sub-menu.
+        :param divider: True if the item is a divider.
+        :param command: Callable to invoke when the menu item is selected.
+        :param annotation: Tooltip of the menu item.
+        :param enable: Whether the menu item is enabled.
+        :param populate: For a sub-menu populated only when the user opens it, callable
+                         returning the list of :class:`MenuItemNode` it should contain.
+        """
+        self.key = key
+        self.label = label
+        self.sub_menu = sub_menu
+        self.divider = divider
+        self.command = command
+        self.annotation = annotation
+        self.enable = enable
+        self.populate = populate
+        self.children = []
+        self._children_by_key = {}
+        # full path of the Maya menu item, once built
+        self.path = None
+
+    @property
+    def kind(self):
+        """
+        Kind of Maya menu item this node needs: divider, sub_menu, lazy_sub_menu or item.
+        """
+        if self.divider:
+            return "divider"
+        if self.sub_menu:
+            return "lazy_sub_menu" if self.populate else "sub_menu"
+        return "item"
+
+    def add_child(self, node):
+        """
+        Add a child node to this sub-menu node.
+
+        :param node: :class:`MenuItemNode` to add.
+        :returns: The added node, or the existing child with the same key.
+        """
+        child = self._children_by_key.get(node.key)
+        if child is not None:
+            return child
+        self._children_by_key[node.key] = node
+        self.children.append(node)
+        return node
+
+    def execute(self):
+        """
+        Invoke the command of this menu item.
+        """
+        if self.command:
+            self.command()
                                 
         
         
@@ -202,39 +501,41 @@ class MenuGenerator(object):
 class AppCommand(object):
     """
     Wraps around a single command that you get from engine.commands
+
+    These records are long lived and held by the :class:`CommandRegistry`.
     """
+
+    __slots__ = ("name", "properties", "callback", "_app_name", "_app_instance_name")
     
-    def __init__(self, name, command_dict):        
+    def __init__(self, name, command_dict, app_instance_name=None):
+        """
+        Constructor.
+
+        :param name: Name of the command.
+        :param command_dict: Command dictionary, as found in engine.commands.
+        :param app_instance_name: Name of the app instance which registered the command,
+                                  as defined in the environment, or None.
+        """
         self.name = name
         self.properties = command_dict["properties"]
         self.callback = command_dict["callback"]
-        self.favourite = False
+        self._app_instance_name = app_instance_name
+        self._app_name = None
+        if "app" in self.properties:
+            self._app_name = self.properties["app"].display_name
         
     def get_app_name(self):
         """
         Returns the name of the app that this command belongs to
         """
-        if "app" in self.properties:
-            return self.properties["app"].display_name
-        return None
+        return self._app_name
         
     def get_app_instance_name(self):
         """
         Returns the name of the app instance, as defined in the environment.
         Returns None if not found.
         """
-        if "app" not in self.properties:
-            return None
-        
-        app_instance = self.properties["app"]
-        engine = app_instance.engine
-
-        for (app_instance_name, app_instance_obj) in engine.apps.items():
-            if app_instance_obj == app_instance:
-                # found our app!
-                return app_instance_name
-            
-        return None
+        return self._app_instance_name
         
     def get_documentation_url_str(self):
         """
@@ -256,9 +557,15 @@ class AppCommand(object):
         """
         return self.properties.get("type", "default")
         
-    def add_command_to_menu(self, menu):
+    def add_command_to_menu(self, menu, sub_menus, enable_states):
         """
         Adds an app command to the menu
+
+        :param menu: :class:`MenuItemNode` to add the command to.
+        :param sub_menus: Dictionary of the sub-menu :class:`MenuItemNode` objects
+                          already created, keyed by (parent node, label).
+                          Sub-menus created for this command are added to it.
+        :param enable_states: :class:`EnableStateCache` to get the command enabled state from.
         """
             
         # create menu sub-tree if need to:
@@ -268,31 +575,32 @@ class AppCommand(object):
         for item_label in parts[:-1]:
 
             # see if there is already a sub-menu item
-            sub_menu = self._find_sub_menu_item(parent_menu, item_label)
-            if sub_menu:
-                # already have sub menu
-                parent_menu = sub_menu
-            else:
+            sub_menu = sub_menus.get((parent_menu, item_label))
+            if sub_menu is None:
                 # create new sub menu
-                params = {
-                    "label" : item_label,
-                    "parent" : parent_menu,
-                    "subMenu" : True
-                }
-                parent_menu = pm.menuItem(**params)
+                sub_menu = parent_menu.add_child(
+                    MenuItemNode("menu:%s" % item_label, label=item_label, sub_menu=True)
+                )
+                sub_menus[(parent_menu, item_label)] = sub_menu
+            parent_menu = sub_menu
             
         # finally create the command menu item:
         params = {
             "label": parts[-1],#self.name,
-            "command": Callback(self._execute_deferred),
-            "parent": parent_menu,
+            "command": self._execute_deferred,
         }
         if "tooltip" in self.properties:
             params["annotation"] = self.properties["tooltip"]
         if "enable_callback" in self.properties:
-            params["enable"] = self.properties["enable_callback"]()
+            # commands can set their own time budget in milliseconds, over the one of the engine
+            time_budget = self.properties.get("enable_callback_time_budget")
+            params["enable"] = enable_states.get_state(
+                self.name,
+                self.properties["enable_callback"],
+                time_budget / 1000.0 if time_budget is not None else None
+            )
             
-        pm.menuItem(**params)
+        parent_menu.add_child(MenuItemNode("command:%s" % self.name, **params))
 
     def _execute_deferred(self):
         """
@@ -300,54 +608,30 @@ class AppCommand(object):
         being deleted, e.g. if the context changes resulting in an engine restart! - this was causing a 
         segmentation fault crash on Linux
         """
-        # note that we use a single shot timer instead of cmds.evalDeferred as we were experiencing
-        # odd behaviour when the deferred command presented a modal dialog that then performed a file 
-        # operation that resulted in a QMessageBox being shown - the deferred command would then run 
-        # a second time, presumably from the event loop of the modal dialog from the first command!
+        # note that the engine scheduler runs its tasks from a single shot timer instead of cmds.evalDeferred
+        # as we were experiencing odd behaviour when the deferred command presented a modal dialog that then
+        # performed a file operation that resulted in a QMessageBox being shown - the deferred command would
+        # then run a second time, presumably from the event loop of the modal dialog from the first command!
         #
         # As the primary purpose of this method is to detach the executing code from the menu invocation,
-        # using a singleShot timer achieves this without the odd behaviour exhibited by evalDeferred.
-        QtCore.QTimer.singleShot(0, self._execute_within_exception_trap)
+        # the command is scheduled with the highest priority to run on the next idle tick.
+        scheduler = tank.platform.current_engine().scheduler
+        scheduler.schedule(scheduler.PRIORITY_HIGH, self._execute_within_exception_trap)
 
     def _execute_within_exception_trap(self):
         """
         Execute the callback and log any exception that gets raised which may otherwise have been
         swallowed by the deferred execution of the callback.
         """
+        start_time = time.time()
         try:
             self.callback()
         except Exception, e:
             current_engine = tank.platform.current_engine()
             current_engine.log_exception("An exception was raised from Toolkit")
 
-    def _find_sub_menu_item(self, menu, label):
-        """
-        Find the 'sub-menu' menu item with the given label
-        """
-        items = pm.menu(menu, query=True, itemArray=True)
-        for item in items:
-            item_path = "%s|%s" % (menu, item)
-            
-            # only care about menuItems that have sub-menus:
-            if not pm.menuItem(item_path, query=True, subMenu=True):
-                continue
-            
-            item_label = pm.menuItem(item_path, query=True, label=True)
-            if item_label == label:
-                return item_path
-
-        return None
-
-
-
-
-
-
-
-
-
-
-
-
-    
-        
+        # keep track of the launches of the app commands, the command
+        # may have switched context and restarted the engine though
+        current_engine = tank.platform.current_engine()
+        if self._app_instance_name and current_engine:
+            current_engine.launch_history.record(self._app_instance_name, self.name, time.time() - start_time)
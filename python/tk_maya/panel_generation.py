@@ -18,79 +18,85 @@ def dock_panel(engine, panel_id, widget_instance, title):
                             This Qt widget is assumed to be child of Maya main window.
                             Its name can be used in standard Maya commands to reparent it under a Maya panel.
     :param title: Title to give to the new dock tab.
+    :returns: Qt widget of the Maya panel, registered under its name "panel_<panel_id>",
+              or None if it could not be found.
     """
 
     # The imports are done here rather than at the module level to avoid spurious imports
     # when this module is reloaded in the context of a workspace control UI script.
+    import maya.cmds as cmds
     import maya.mel as mel
-    import maya.utils
-    import pymel.core as pm
 
     # Retrieve the unique string identifier naming the Qt widget.
     widget_id = widget_instance.objectName()
 
+    # Keep the widget registered, it will be looked up by name while docked.
+    from .panel_util import register_widget
+    register_widget(widget_instance)
+
     # Create the Maya panel name.
     maya_panel_id = "panel_%s" % panel_id
 
     # When the Maya panel already exists, it can be deleted safely since its embedded
     # Shotgun app panel widget has already been reparented under Maya main window.
-    if pm.control(maya_panel_id, query=True, exists=True):
-        engine.log_debug("Deleting existing Maya panel %s." % maya_panel_id)
-        pm.deleteUI(maya_panel_id)
+    if cmds.control(maya_panel_id, query=True, exists=True):
+        engine.log_debug("Deleting existing Maya panel %s.", maya_panel_id)
+        cmds.deleteUI(maya_panel_id)
 
     # Use the proper Maya panel docking method according to the Maya version.
     if mel.eval("getApplicationVersionAsFloat()") < 2017:
 
         # Create a new Maya window.
-        maya_window = pm.window()
-        engine.log_debug("Created Maya window %s." % maya_window)
+        maya_window = cmds.window()
+        engine.log_debug("Created Maya window %s.", maya_window)
 
         # Add a layout to the Maya window.
-        maya_layout = pm.formLayout(parent=maya_window)
-        engine.log_debug("Created Maya layout %s." % maya_layout)
+        maya_layout = cmds.formLayout(parent=maya_window)
+        engine.log_debug("Created Maya layout %s.", maya_layout)
 
         # Reparent the Shotgun app panel widget under the Maya window layout.
-        engine.log_debug("Reparenting Shotgun app panel widget %s under Maya layout %s." % (widget_id, maya_layout))
-        pm.control(widget_id, edit=True, parent=maya_layout)
+        engine.log_debug("Reparenting Shotgun app panel widget %s under Maya layout %s.", widget_id, maya_layout)
+        cmds.control(widget_id, edit=True, parent=maya_layout)
 
         # Keep the Shotgun app panel widget sides aligned with the Maya window layout sides.
-        pm.formLayout(maya_layout,
-                      edit=True,
-                      attachForm=[(widget_id, 'top', 1),
-                                  (widget_id, 'left', 1),
-                                  (widget_id, 'bottom', 1),
-                                  (widget_id, 'right', 1)]
+        cmds.formLayout(maya_layout,
+                        edit=True,
+                        attachForm=[(widget_id, 'top', 1),
+                                    (widget_id, 'left', 1),
+                                    (widget_id, 'bottom', 1),
+                                    (widget_id, 'right', 1)]
         )
 
         # Dock the Maya window into a new tab of Maya Channel Box dock area.
-        engine.log_debug("Creating Maya panel %s." % maya_panel_id)
-        pm.dockControl(maya_panel_id, area="right", content=maya_window, label=title)
+        engine.log_debug("Creating Maya panel %s.", maya_panel_id)
+        cmds.dockControl(maya_panel_id, area="right", content=maya_window, label=title)
 
         # Once Maya will have completed its UI update and be idle,
         # raise (with "r=True") the new dock tab to the top.
-        maya.utils.executeDeferred("cmds.dockControl('%s', edit=True, r=True)" % maya_panel_id)
+        engine.scheduler.schedule(engine.scheduler.PRIORITY_NORMAL,
+                                  lambda: cmds.dockControl(maya_panel_id, edit=True, r=True))
 
     else:  # Maya 2017 and later
 
         # Delete any default workspace control state that might have been automatically
         # created by Maya when a previously existing Maya panel was closed and deleted.
-        if pm.workspaceControlState(maya_panel_id, exists=True):
-            engine.log_debug("Deleting existing Maya workspace panel state %s." % maya_panel_id)
-            pm.workspaceControlState(maya_panel_id, remove=True)
+        if cmds.workspaceControlState(maya_panel_id, exists=True):
+            engine.log_debug("Deleting existing Maya workspace panel state %s.", maya_panel_id)
+            cmds.workspaceControlState(maya_panel_id, remove=True)
 
         # Retrieve the Channel Box dock area, with error reporting turned off.
         # This MEL function is declared in Maya startup script file UIComponents.mel.
         # It returns an empty string when this dock area cannot be found in the active Maya workspace.
         dock_area = mel.eval('getUIComponentDockControl("Channel Box / Layer Editor", false)')
-        engine.log_debug("Retrieved Maya dock area %s." % dock_area)
+        engine.log_debug("Retrieved Maya dock area %s.", dock_area)
 
         # This UI script will be called to build the UI of the new dock tab.
         # It will embed the Shotgun app panel widget into a Maya workspace control.
         # Maya 2017 expects this script to be passed in as a string, not as a function pointer.
         # See function _build_workspace_control_ui() below for a commented version of this script.
-        ui_script = "import pymel.core as pm\n" \
-                    "workspace_control = pm.setParent(query=True)\n" \
-                    "pm.control('%s', edit=True, parent=workspace_control)" \
+        ui_script = "import maya.cmds as cmds\n" \
+                    "workspace_control = cmds.setParent(query=True)\n" \
+                    "cmds.control('%s', edit=True, parent=workspace_control)" \
                     % widget_id
 
         # The following UI script can be used for development and debugging purposes.
@@ -110,23 +116,23 @@ def dock_panel(engine, panel_id, widget_instance, title):
         else:
             # Since no size is recommended for the widget, use its current width.
             widget_width = widget_instance.width()
-        engine.log_debug("Widget %s width: %s" % (widget_id, widget_width))
+        engine.log_debug("Widget %s width: %s", widget_id, widget_width)
 
         # Dock the Shotgun app panel widget into a new tab of the Channel Box dock area.
         # When this dock area was not found in the active Maya workspace,
         # the Shotgun app panel widget is embedded into a floating workspace control window.
         # This floating workspace control can then be docked into an existing dock area by the user.
-        engine.log_debug("Creating Maya workspace panel %s." % maya_panel_id)
-        dock_tab = pm.workspaceControl(maya_panel_id,
-                                       tabToControl=(dock_area, -1),  # -1 to append a new tab
-                                       uiScript=ui_script,
-                                       loadImmediately=True,
-                                       retain=False,  # delete the dock tab when it is closed
-                                       label=title,
-                                       initialWidth=widget_width,
-                                       minimumWidth=True,  # set the minimum width to the initial width
-                                       r=True  # raise the new dock tab to the top
-                   )
+        engine.log_debug("Creating Maya workspace panel %s.", maya_panel_id)
+        dock_tab = cmds.workspaceControl(maya_panel_id,
+                                         tabToControl=(dock_area, -1),  # -1 to append a new tab
+                                         uiScript=ui_script,
+                                         loadImmediately=True,
+                                         retain=False,  # delete the dock tab when it is closed
+                                         label=title,
+                                         initialWidth=widget_width,
+                                         minimumWidth=True,  # set the minimum width to the initial width
+                                         r=True  # raise the new dock tab to the top
+                     )
 
         # Now that the workspace dock tab has been created, let's update its UI script.
         # This updated script will be saved automatically with the workspace control state
@@ -146,7 +152,36 @@ def dock_panel(engine, panel_id, widget_instance, title):
                     % deferred_script
 
         # Update the workspace dock tab UI script.
-        pm.workspaceControl(maya_panel_id, edit=True, uiScript=ui_script)
+        cmds.workspaceControl(maya_panel_id, edit=True, uiScript=ui_script)
+
+    # Keep the Maya panel widget registered, its events are monitored while the panel is docked.
+    return _register_maya_control(maya_panel_id)
+
+
+def _register_maya_control(control_name):
+    """
+    Registers the Qt widget of a Maya control under the name of the control.
+
+    :param control_name: Name of the Maya control.
+    :returns: Qt widget of the Maya control or None if it could not be found.
+    """
+
+    from tank.platform.qt import QtGui
+    import maya.OpenMayaUI as OpenMayaUI
+
+    try:
+        import shiboken2 as shiboken
+    except ImportError:
+        import shiboken
+
+    from .panel_util import register_widget
+
+    ptr = OpenMayaUI.MQtUtil.findControl(control_name)
+    if ptr is None:
+        return None
+    widget = shiboken.wrapInstance(long(ptr), QtGui.QWidget)
+    register_widget(widget)
+    return widget
 
 
 def _build_workspace_control_ui(widget_id):
@@ -158,10 +193,10 @@ def _build_workspace_control_ui(widget_id):
                       Its name can be used in standard Maya commands to reparent it under a Maya panel.
     """
 
-    import pymel.core as pm
+    import maya.cmds as cmds
 
     # In the context of this function, setParent() returns the calling workspace control.
-    workspace_control = pm.setParent(query=True)
+    workspace_control = cmds.setParent(query=True)
 
     # Reparent the Shotgun app panel widget under the workspace control.
-    pm.control(widget_id, edit=True, parent=workspace_control)
+    cmds.control(widget_id, edit=True, parent=workspace_control)
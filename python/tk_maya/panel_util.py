@@ -13,21 +13,31 @@ Panel support utilities for Maya
 """
 import os
 import sys
+import weakref
 import sgtk
 from sgtk.platform.qt import QtCore, QtGui
 
+# Qt widgets keyed by object name. Only weak references are kept, so that the
+# registry does not keep alive widgets that were closed and deleted.
+_widgets = weakref.WeakValueDictionary()
+
+# names of the widgets to repaint on the next pass of the event loop
+_dirty_widget_ids = set()
+# number of repaints requested by the panels and number of repaints actually done
+_repaint_counts = {"requested": 0, "performed": 0}
+
 def install_callbacks(panel_id, widget_id):
     """
     Helper method to assist in the panel creation process.
-    This will iterate over all QT widgets and look for a panel_id
-    widget. Once found, it will install an event filter on this panel
+    This will look up the panel_id widget, registered when the panel
+    was docked. Once found, it will install an event filter on this panel
     to monitor its close event, so that we can gracefully handle close,
     refresh and deallocation of the embedded tk widget when this happens.
     
-    :param panel_id: Object name for panel
+    :param panel_id: Object name for the Maya panel
     :param widget_id: Object name for tk widget
     """
-    widget = _find_widget(panel_id)
+    widget = find_widget(panel_id)
     if widget:
         filter = CloseEventFilter(widget)
         filter.set_associated_widget(widget_id)
@@ -35,16 +45,38 @@ def install_callbacks(panel_id, widget_id):
         filter.parent_dirty.connect(_on_parent_refresh_callback)
         widget.installEventFilter(filter)
 
-def _find_widget(widget_name):
+def register_widget(widget):
     """
-    Given a name, return the first corresponding
-    QT widget that is found.
-    
+    Registers a widget under its object name, so that it can
+    be found without going through all the QT widgets.
+
+    :param widget: QWidget object to register
+    """
+    _widgets[widget.objectName()] = widget
+
+def find_widget(widget_name):
+    """
+    Given a name, return the corresponding QT widget.
+
+    Registered widgets are returned right away. Otherwise, the
+    first widget found with this name is registered and returned.
+
     :param widget_name: QT object name to look for
     :returns: QWidget object or None if nothing was found
-    """ 
+    """
+    widget = _widgets.get(widget_name)
+    if widget is not None:
+        try:
+            if widget.objectName() == widget_name:
+                return widget
+        except RuntimeError:
+            # the underlying QT widget was deleted
+            pass
+        _widgets.pop(widget_name, None)
+
     for widget in QtGui.QApplication.allWidgets():
         if widget.objectName() == widget_name:
+            _widgets[widget_name] = widget
             return widget
     return None
 
@@ -56,28 +88,58 @@ def _on_parent_closed_callback(widget_id):
     
     :param widget_id: Object name of widget to close
     """
-    widget = _find_widget(widget_id)
+    widget = find_widget(widget_id)
     if widget:
         widget.close()
         # delete later since we are inside a slot
         widget.deleteLater()
+        _widgets.pop(widget_id, None)
     
+def get_repaint_counts():
+    """
+    Returns the number of panel repaints requested and performed
+    since Maya started.
+
+    :returns: Dictionary with keys requested and performed
+    """
+    return dict(_repaint_counts)
+
 def _on_parent_refresh_callback(widget_id):
     """
     Callback which fires when a UI refresh is needed.
+
+    Panels can ask for many refreshes in a row, for example while
+    being resized, so the refreshes are done once per pass of the
+    event loop.
     
     :param widget_id: Object name of widget to refresh
     """
-    widget = _find_widget(widget_id)
-    if widget:
-        # this is a pretty blunt tool, but right now I cannot
-        # come up with a better solution - it seems the internal
-        # window parenting in maya is a little off - and/or I am
-        # not parenting up the QT widgets correctly, and I think
-        # this is the reason the UI refresh isn't working correctly.
-        # the only way to ensure a fully refreshed UI is to repaint 
-        # the entire window.
-        widget.window().update()
+    _repaint_counts["requested"] += 1
+    if not _dirty_widget_ids:
+        # a timer rather than the scheduler of the engine, which drops its tasks when the
+        # engine is destroyed, while the dirty widgets outlive engines
+        QtCore.QTimer.singleShot(0, _repaint_dirty_widgets)
+    _dirty_widget_ids.add(widget_id)
+
+def _repaint_dirty_widgets():
+    """
+    Repaints the widgets which asked for a refresh.
+    """
+    widget_ids = list(_dirty_widget_ids)
+    _dirty_widget_ids.clear()
+    for widget_id in widget_ids:
+        widget = find_widget(widget_id)
+        if widget:
+            # it seems the internal window parenting in maya is a little
+            # off - and/or I am not parenting up the QT widgets correctly,
+            # and I think this is the reason the UI refresh isn't working
+            # correctly. the widget does not repaint properly on its own, so
+            # repaint the area of the window it covers, rather than the
+            # entire window and its viewports.
+            window = widget.window()
+            area = QtCore.QRect(widget.mapTo(window, QtCore.QPoint(0, 0)), widget.size())
+            window.update(area)
+            _repaint_counts["performed"] += 1
 
 class CloseEventFilter(QtCore.QObject):
     """
@@ -106,7 +168,7 @@ class CloseEventFilter(QtCore.QObject):
         # peek at the message
         if event.type() == QtCore.QEvent.Close:
             # make sure the associated widget is still a descendant of the object
-            parent = _find_widget(self._widget_id)
+            parent = find_widget(self._widget_id)
             while parent:
                 if parent == obj:
                     # re-broadcast the close event
@@ -0,0 +1,319 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Workstation wide resolution of scene files, shared by all the Maya sessions of a user.
+
+A resolver daemon listens on a Unix domain socket and caches the pipeline
+configuration and context of the files it is asked about. The sessions query
+it with a :class:`ResolverClient` before resolving files themselves.
+
+The protocol is one json object per line: requests are ``{"path": <path>}`` and
+replies either ``{"result": <result>}``, ``{"error": <message>}`` when the path
+does not belong to any Toolkit project, or ``{"failure": <message>}`` when the
+resolution failed for another reason.
+
+The daemon is started with::
+
+    python resolver_daemon.py <socket path>
+
+from an interpreter able to import the Toolkit core.
+"""
+
+import os
+import sys
+import json
+import stat
+import time
+import socket
+import threading
+import collections
+import SocketServer
+
+
+def resolve_path(path):
+    """
+    Resolves a file with the Toolkit core. This is the resolve function of the daemon.
+
+    :param path: Path of the file.
+    :returns: Dictionary with the ``config_path`` of the pipeline configuration the file
+              belongs to and the entity dictionaries of its ``context``, keyed by the
+              names of the :class:`tank.Context` constructor parameters.
+    :raises TankError: If the path does not belong to any Toolkit project.
+    """
+    import tank
+    tk = tank.tank_from_path(path)
+    context = tk.context_from_path(path)
+    return {
+        "config_path": tk.pipeline_configuration.get_path(),
+        "context": {
+            "project": context.project,
+            "entity": context.entity,
+            "step": context.step,
+            "task": context.task,
+            "user": context.user,
+            "additional_entities": context.additional_entities,
+        },
+    }
+
+
+class ResolverServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    Daemon answering resolution requests over a Unix domain socket.
+
+    Results are cached for a limited time, in a bounded least recently used cache,
+    so that files opened in several sessions are only resolved once.
+    """
+
+    daemon_threads = True
+
+    # maximum number of results kept in the cache
+    CACHE_SIZE = 1024
+    # time in seconds a result is kept in the cache
+    CACHE_TTL = 300
+
+    def __init__(self, socket_path, resolve_fn, error_types=()):
+        """
+        Constructor.
+
+        :param socket_path: Path of the Unix domain socket to listen on.
+        :param resolve_fn: Function taking the path of a file and returning a json
+                           serializable result, see :func:`resolve_path`.
+        :param error_types: Tuple of the exception types raised by the resolve function
+                            when a path does not belong to any Toolkit project.
+        """
+        if _is_socket(socket_path):
+            # left over by a daemon which did not shut down cleanly
+            os.remove(socket_path)
+        elif os.path.lexists(socket_path):
+            raise ValueError("%s exists and is not a socket, not replacing it." % socket_path)
+        # the replies name the pipeline configurations the sessions load hooks from,
+        # only the user running the daemon may talk to it, from the moment the socket is bound
+        previous_umask = os.umask(0177)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, socket_path, _ResolverRequestHandler)
+        finally:
+            os.umask(previous_umask)
+        os.chmod(socket_path, stat.S_IRUSR | stat.S_IWUSR)
+        self._socket_path = socket_path
+        self._resolve_fn = resolve_fn
+        self._error_types = error_types
+        self._lock = threading.Lock()
+        # (reply, time stamp) keyed by normalized path, least recently used first
+        self._cache = collections.OrderedDict()
+
+    def resolve(self, path):
+        """
+        Returns the reply to a resolution request, from the cache if possible.
+
+        :param path: Path of the file.
+        :returns: Reply dictionary.
+        """
+        key = os.path.normcase(os.path.normpath(path))
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry is not None and time.time() - entry[1] < self.CACHE_TTL:
+                self._cache[key] = entry
+                return entry[0]
+
+        try:
+            reply = {"result": self._resolve_fn(path)}
+        except self._error_types, e:
+            reply = {"error": str(e)}
+        except Exception, e:
+            # not cached, the next request tries again
+            return {"failure": str(e)}
+
+        with self._lock:
+            self._cache[key] = (reply, time.time())
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return reply
+
+    def server_close(self):
+        """
+        Stops listening and removes the socket file.
+        """
+        SocketServer.UnixStreamServer.server_close(self)
+        if _is_socket(self._socket_path):
+            os.remove(self._socket_path)
+
+
+class _ResolverRequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Answers the requests of a client connection, one per line.
+    """
+
+    def handle(self):
+        """
+        Reads requests until the client closes the connection.
+        """
+        for line in iter(self.rfile.readline, ""):
+            try:
+                reply = self.server.resolve(json.loads(line)["path"])
+            except (ValueError, KeyError, TypeError), e:
+                reply = {"failure": "Invalid request: %s" % e}
+            self.wfile.write(json.dumps(reply) + "\n")
+            self.wfile.flush()
+
+
+class ResolverClient(object):
+    """
+    Connection of a Maya session to the resolver daemon.
+
+    When the daemon cannot be reached, the client stays quiet for a while before
+    trying again, so that sessions fall back to resolving files themselves at
+    no extra cost.
+    """
+
+    # time in seconds to wait for a reply of the daemon
+    TIMEOUT = 2.0
+    # time in seconds before trying to reach a daemon which could not be reached
+    RETRY_DELAY = 60
+
+    def __init__(self, socket_path):
+        """
+        Constructor.
+
+        :param socket_path: Path of the Unix domain socket the daemon listens on.
+        """
+        self._socket_path = socket_path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._unavailable_since = None
+
+    @property
+    def socket_path(self):
+        """
+        Path of the Unix domain socket the daemon listens on.
+        """
+        return self._socket_path
+
+    @property
+    def available(self):
+        """
+        False if the platform has no Unix domain sockets or if the daemon
+        could not be reached recently, True otherwise.
+        """
+        if not hasattr(socket, "AF_UNIX"):
+            return False
+        return self._unavailable_since is None or time.time() - self._unavailable_since > self.RETRY_DELAY
+
+    def resolve(self, path):
+        """
+        Asks the daemon to resolve a file.
+
+        :param path: Path of the file.
+        :returns: Reply dictionary, see the module documentation,
+                  or None if the daemon could not be reached.
+        """
+        if not self.available:
+            return None
+
+        with self._lock:
+            # a connection left open may have been closed by a daemon which restarted
+            attempts = 2 if self._connection is not None else 1
+            for attempt in range(attempts):
+                try:
+                    if self._connection is None:
+                        self._connection = self._connect()
+                    self._connection.sendall(json.dumps({"path": path}) + "\n")
+                    reply = json.loads(self._read_line())
+                    self._unavailable_since = None
+                    return reply
+                except (socket.error, ValueError):
+                    self.close()
+            self._unavailable_since = time.time()
+            return None
+
+    def close(self):
+        """
+        Closes the connection to the daemon.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _connect(self):
+        """
+        Connects to the daemon.
+
+        :returns: Connected socket.
+        :raises socket.error: If the daemon cannot be reached, or if the socket does not
+                              belong to the current user, since the sessions load the
+                              hooks of the pipeline configurations named by the replies.
+        """
+        try:
+            socket_stat = os.lstat(self._socket_path)
+        except OSError, e:
+            raise socket.error(str(e))
+        if not stat.S_ISSOCK(socket_stat.st_mode) or socket_stat.st_uid != os.getuid():
+            raise socket.error("%s is not a socket owned by the current user." % self._socket_path)
+
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.TIMEOUT)
+        try:
+            connection.connect(self._socket_path)
+        except socket.error:
+            connection.close()
+            raise
+        return connection
+
+    def _read_line(self):
+        """
+        Reads a reply line from the daemon.
+
+        :returns: The line, without its end of line character.
+        :raises socket.error: If the connection was closed or timed out.
+        """
+        chunks = []
+        while True:
+            chunk = self._connection.recv(4096)
+            if not chunk:
+                raise socket.error("Connection closed by the resolver daemon.")
+            chunks.append(chunk)
+            if chunk.endswith("\n"):
+                return "".join(chunks)[:-1]
+
+
+def _is_socket(path):
+    """
+    Tells if a path is a Unix domain socket, without following symbolic links.
+
+    :param path: Path to check.
+    :returns: True if the path is a socket, False if it is anything else or does not exist.
+    """
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except OSError:
+        return False
+
+
+def main(socket_path):
+    """
+    Runs the resolver daemon until interrupted.
+
+    :param socket_path: Path of the Unix domain socket to listen on.
+    """
+    import tank
+    server = ResolverServer(socket_path, resolve_path, (tank.TankError,))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.stderr.write("Usage: %s <socket path>\n" % sys.argv[0])
+        sys.exit(1)
+    main(sys.argv[1])
@@ -0,0 +1,709 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Resolution of the Toolkit API instance and context of the scene files opened in Maya.
+"""
+
+import os
+import time
+import socket
+import threading
+import collections
+
+import tank
+
+# parts of the messages of the core errors raised for paths outside of any project,
+# as opposed to the errors raised because Shotgun or the disk could not be reached
+_UNRESOLVED_PATH_MESSAGES = (
+    "does not seem to belong to any",
+    "does not belong to any",
+    "not associated with any",
+)
+
+# extensions of the Maya scene files
+_SCENE_EXTENSIONS = (".ma", ".mb")
+
+# pipeline configuration files whose modification invalidates a cached API instance
+_CONFIG_FILES = [
+    os.path.join("config", "core", "pipeline_configuration.yml"),
+    os.path.join("config", "core", "roots.yml"),
+    os.path.join("config", "core", "templates.yml"),
+]
+
+
+def _normalize_path(path):
+    """
+    Normalizes a path so that it can be compared with other normalized paths.
+
+    :param path: Path to normalize.
+    :returns: The normalized path.
+    """
+    return os.path.normcase(os.path.normpath(path))
+
+
+def _is_path_under(path, folder):
+    """
+    Tells if a normalized path is a normalized folder or lives under it.
+
+    :param path: Normalized path.
+    :param folder: Normalized folder path.
+    :returns: True if the path is under the folder, False otherwise.
+    """
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+
+def is_unresolved_path_error(error):
+    """
+    Tells if an error was raised because a path does not belong to any Toolkit project.
+
+    :param error: TankError raised while resolving a path.
+    :returns: True if the path is outside of any project, False if the error is
+              of another nature, for example a timeout, and may not happen again.
+    """
+    message = str(error).lower()
+    return any(text in message for text in _UNRESOLVED_PATH_MESSAGES)
+
+
+def get_config_fingerprint(tk):
+    """
+    Returns a fingerprint of the pipeline configuration of an API instance,
+    which changes whenever its core configuration files are modified.
+
+    :param tk: Toolkit API instance.
+    :returns: Tuple of the configuration path and the modification times of its files.
+    """
+    config_path = tk.pipeline_configuration.get_path()
+    mtimes = []
+    for config_file in _CONFIG_FILES:
+        try:
+            mtimes.append(os.path.getmtime(os.path.join(config_path, config_file)))
+        except OSError:
+            mtimes.append(None)
+    return (config_path,) + tuple(mtimes)
+
+
+class TankInstanceCache(object):
+    """
+    Bounded, least recently used cache of Toolkit API instances keyed by
+    pipeline configuration root.
+
+    A cached instance is reused for any path under one of its project roots, as
+    long as the core files of its pipeline configuration were not modified since
+    the instance was created.
+    """
+
+    def __init__(self, max_size):
+        """
+        Constructor.
+
+        :param max_size: Maximum number of API instances to keep.
+        """
+        self._max_size = max_size
+        # (tk, fingerprint, normalized project roots) keyed by pipeline configuration root,
+        # least recently used first
+        self._entries = collections.OrderedDict()
+
+    def add(self, tk):
+        """
+        Adds an API instance to the cache.
+
+        :param tk: Toolkit API instance.
+        """
+        config_path = tk.pipeline_configuration.get_path()
+        roots = [_normalize_path(root) for root in tk.roots.values() if root]
+        self._entries.pop(config_path, None)
+        self._entries[config_path] = (tk, get_config_fingerprint(tk), roots)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def get_for_path(self, path):
+        """
+        Returns the cached API instance whose project holds a path.
+
+        :param path: Path of a file.
+        :returns: Toolkit API instance or None if no valid one is cached.
+        """
+        path = _normalize_path(path)
+        for (config_path, (tk, fingerprint, roots)) in self._entries.items():
+            if any(_is_path_under(path, root) for root in roots):
+                return self._use(config_path)
+        return None
+
+    def get_for_config(self, config_path):
+        """
+        Returns the cached API instance of a pipeline configuration.
+
+        :param config_path: Root of the pipeline configuration.
+        :returns: Toolkit API instance or None if no valid one is cached.
+        """
+        if config_path not in self._entries:
+            return None
+        return self._use(config_path)
+
+    def _use(self, config_path):
+        """
+        Returns a cached API instance if still valid, and marks it as most recently used.
+
+        :param config_path: Root of the pipeline configuration of a cached instance.
+        :returns: Toolkit API instance or None if the cached instance is stale.
+        """
+        (tk, fingerprint, roots) = self._entries.pop(config_path)
+        if get_config_fingerprint(tk) != fingerprint:
+            # the configuration changed on disk, the instance is stale
+            return None
+        # put the entry back at the end, as most recently used
+        self._entries[config_path] = (tk, fingerprint, roots)
+        return tk
+
+    def clear(self):
+        """
+        Removes all the cached API instances.
+        """
+        self._entries.clear()
+
+
+class UnresolvedPathCache(object):
+    """
+    Remembers for a limited time the folders holding files which could
+    not be resolved to a Toolkit project.
+
+    Only the files directly in these folders are considered not to resolve,
+    the projects can live in their sub folders.
+    """
+
+    def __init__(self, ttl):
+        """
+        Constructor.
+
+        :param ttl: Time in seconds a folder is remembered for.
+        """
+        self._ttl = ttl
+        # expiration times keyed by normalized folder path
+        self._folders = {}
+
+    def add(self, path):
+        """
+        Remembers the folder of a file which could not be resolved.
+
+        :param path: Path of the file.
+        """
+        now = time.time()
+        # forget the expired folders
+        for (folder, expiration_time) in self._folders.items():
+            if expiration_time < now:
+                del self._folders[folder]
+        self._folders[_normalize_path(os.path.dirname(path))] = now + self._ttl
+
+    def contains(self, path):
+        """
+        Tells if a file lives in a folder known not to resolve.
+
+        :param path: Path of the file.
+        :returns: True if the file is known not to resolve, False otherwise.
+        """
+        folder = _normalize_path(os.path.dirname(path))
+        expiration_time = self._folders.get(folder)
+        if expiration_time is None:
+            return False
+        if expiration_time < time.time():
+            del self._folders[folder]
+            return False
+        return True
+
+    def clear(self):
+        """
+        Forgets all the folders.
+
+        :returns: The number of folders which were remembered.
+        """
+        count = len(self._folders)
+        self._folders.clear()
+        return count
+
+
+class ContextCache(object):
+    """
+    Bounded, least recently used cache of the contexts resolved from file paths.
+
+    Contexts are keyed by the normalized path of the file and by the fingerprint of
+    the pipeline configuration used to resolve them, so that modifying the templates
+    invalidates them.
+    """
+
+    def __init__(self, max_size):
+        """
+        Constructor.
+
+        :param max_size: Maximum number of contexts to keep.
+        """
+        self._max_size = max_size
+        # (previous context, context) keyed by (normalized path, fingerprint),
+        # least recently used first
+        self._entries = collections.OrderedDict()
+
+    def get(self, tk, path, previous_context):
+        """
+        Returns the cached context of a file.
+
+        The context of a path can depend on the previous context, which is used
+        to fill in what the path does not tell. A cached context is therefore only
+        returned if it was resolved with the same previous context, or if it is the
+        previous context itself, which is the case when saving the same file again.
+
+        :param tk: Toolkit API instance the path belongs to.
+        :param path: Path of the file.
+        :param previous_context: Context the engine is currently running in.
+        :returns: The cached context or None if not found.
+        """
+        key = (_normalize_path(path), get_config_fingerprint(tk))
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        # put the entry back at the end, as most recently used
+        self._entries[key] = entry
+        (cached_previous_context, context) = entry
+        if context == previous_context or cached_previous_context == previous_context:
+            return context
+        return None
+
+    def add(self, tk, path, previous_context, context):
+        """
+        Adds the context of a file to the cache.
+
+        :param tk: Toolkit API instance the path belongs to.
+        :param path: Path of the file.
+        :param previous_context: Context the context was resolved with.
+        :param context: Context of the file.
+        """
+        key = (_normalize_path(path), get_config_fingerprint(tk))
+        self._entries.pop(key, None)
+        self._entries[key] = (previous_context, context)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all the cached contexts.
+        """
+        self._entries.clear()
+
+
+class SceneResolver(object):
+    """
+    Resolves the Toolkit API instance and context of scene files, caching what it
+    can across scene events.
+
+    The resolver outlives the engine instances: when a scene event restarts the
+    engine, the new engine adopts the resolver of the previous one.
+
+    When a resolver daemon is configured, files missing from the caches are looked
+    up in the daemon before being resolved by the session itself.
+
+    Files can be resolved ahead of time on a worker thread, for example while Maya
+    is loading them. Looking up a file which is being resolved in the background
+    waits for that resolution to complete and then uses its cached results.
+    """
+
+    # maximum number of Toolkit API instances kept in the cache
+    TK_CACHE_SIZE = 8
+    # time in seconds folders of files outside of any project are remembered
+    UNRESOLVED_PATH_TTL = 300
+    # maximum number of contexts kept in the cache
+    CONTEXT_CACHE_SIZE = 64
+    # maximum number of files resolved ahead of time by a background warm up,
+    # kept well under the context cache size so that it does not flush the cache
+    WARM_UP_MAX_FILES = 24
+    # time in seconds the warm up sleeps between two files, to leave the
+    # interpreter to the main thread as much as possible
+    WARM_UP_FILE_INTERVAL = 0.05
+    # number of folder levels searched for scene files under the context folders,
+    # so that the warm up of a project context does not walk the whole project
+    WARM_UP_MAX_DEPTH = 2
+    # folders never searched for scene files, like the Maya incremental save backups
+    WARM_UP_SKIPPED_FOLDERS = ("incrementalSave",)
+
+    def __init__(self, engine):
+        """
+        Constructor.
+
+        :param engine: :class:`MayaEngine` instance running in Maya.
+        """
+        self._engine = engine
+        # the caches are shared with the worker threads
+        self._lock = threading.Lock()
+        self._tk_cache = TankInstanceCache(self.TK_CACHE_SIZE)
+        self._tk_cache.add(engine.sgtk)
+        self._unresolved_paths = UnresolvedPathCache(self.UNRESOLVED_PATH_TTL)
+        self._context_cache = ContextCache(self.CONTEXT_CACHE_SIZE)
+        # (normalized path, thread) of the file being resolved in the background
+        self._prefetch = None
+        # event set to cancel the running background warm up
+        self._warm_up_cancelled = None
+        # [count, total time] of the context switches, keyed by kind of switch
+        self._switch_timings = {}
+        # client of the workstation resolver daemon, if any
+        self._daemon = None
+        self._connect_daemon(engine)
+
+    def record_context_switch(self, kind, duration):
+        """
+        Records how long a context switch took.
+
+        :param kind: Kind of switch, "in_place" when the engine changed its context
+                     or "restart" when the engine was destroyed and started again.
+        :param duration: Time in seconds the switch took.
+        """
+        timing = self._switch_timings.setdefault(kind, [0, 0.0])
+        timing[0] += 1
+        timing[1] += duration
+        self._engine.log_debug(
+            "Context switch (%s) took %0.3fs, %0.3fs on average over %d switches.",
+            kind, duration, timing[1] / timing[0], timing[0]
+        )
+
+    def attach(self, engine):
+        """
+        Attaches the resolver to a new engine instance.
+
+        :param engine: :class:`MayaEngine` instance running in Maya.
+        """
+        self._engine = engine
+        with self._lock:
+            self._tk_cache.add(engine.sgtk)
+        self._connect_daemon(engine)
+
+    def prefetch(self, path, previous_context):
+        """
+        Starts resolving the API instance and context of a file on a worker thread.
+
+        :param path: Path of the file.
+        :param previous_context: Context the engine is currently running in.
+        """
+        thread = threading.Thread(
+            target=self._resolve_in_background,
+            args=(path, previous_context),
+            name="tk-maya scene resolution"
+        )
+        thread.daemon = True
+        self._prefetch = (_normalize_path(path), thread)
+        thread.start()
+
+    def warm_up(self, paths, previous_context):
+        """
+        Starts resolving a list of files, and the scene files found in the work
+        area of the current context, on a low priority worker thread, so that
+        opening one of them later hits the caches. A warm up already running
+        is cancelled.
+
+        :param paths: Paths of the files to resolve, most likely to be opened first.
+        :param previous_context: Context the engine is currently running in. The folders
+                                 of its work area are searched after the files.
+        """
+        if self._warm_up_cancelled is not None:
+            self._warm_up_cancelled.set()
+        self._warm_up_cancelled = threading.Event()
+
+        thread = threading.Thread(
+            target=self._warm_up_in_background,
+            args=(list(paths), previous_context, self._warm_up_cancelled),
+            name="tk-maya scene resolution warm up"
+        )
+        thread.daemon = True
+        thread.start()
+
+    def cancel_warm_up(self):
+        """
+        Cancels the running background warm up, if any.
+        """
+        if self._warm_up_cancelled is not None:
+            self._warm_up_cancelled.set()
+            self._warm_up_cancelled = None
+
+    def is_unresolved(self, path):
+        """
+        Tells if a file was recently found not to belong to any Toolkit project.
+
+        :param path: Path of the file.
+        :returns: True if the file is known not to resolve, False otherwise.
+        """
+        self._wait_for_prefetch(path)
+        with self._lock:
+            return self._unresolved_paths.contains(path)
+
+    def clear_unresolved_paths(self):
+        """
+        Forgets the files found not to belong to any Toolkit project,
+        so that they are resolved again on the next scene event.
+
+        :returns: The number of folders which were forgotten.
+        """
+        with self._lock:
+            return self._unresolved_paths.clear()
+
+    def get_tk(self, path):
+        """
+        Returns the Toolkit API instance to use for a file.
+
+        :param path: Path of the file.
+        :returns: Toolkit API instance.
+        :raises TankError: If the path does not belong to any Toolkit project.
+        """
+        self._wait_for_prefetch(path)
+        return self._get_tk(path)
+
+    def get_context(self, tk, path, previous_context):
+        """
+        Returns the context of a file.
+
+        :param tk: Toolkit API instance the path belongs to.
+        :param path: Path of the file.
+        :param previous_context: Context the engine is currently running in.
+        :returns: The context of the file.
+        """
+        self._wait_for_prefetch(path)
+        return self._get_context(tk, path, previous_context)
+
+    def _get_tk(self, path, remember_unresolved=True):
+        """
+        Returns the Toolkit API instance to use for a file, from the cache if possible.
+
+        :param path: Path of the file.
+        :param remember_unresolved: If False, the folder of a file outside of any
+                                    project is not remembered as such.
+        :returns: Toolkit API instance.
+        :raises TankError: If the path does not belong to any Toolkit project.
+        """
+        with self._lock:
+            if self._unresolved_paths.contains(path):
+                raise tank.TankError("The path '%s' was recently found not to belong to "
+                                     "any Toolkit project." % path)
+            tk = self._tk_cache.get_for_path(path)
+
+        if tk is not None:
+            self._engine.log_debug("Reusing cached API instance %s for %s.", tk, path)
+            return tk
+
+        try:
+            result = self._query_daemon(path)
+            if result is None:
+                tk = tank.tank_from_path(path)
+            else:
+                tk = self._get_tk_for_config(result["config_path"])
+        except tank.TankError, e:
+            # other errors, like Shotgun timeouts, are not remembered and the path is tried again
+            if remember_unresolved and is_unresolved_path_error(e):
+                with self._lock:
+                    self._unresolved_paths.add(path)
+            raise
+        with self._lock:
+            self._tk_cache.add(tk)
+        return tk
+
+    def _get_tk_for_config(self, config_path):
+        """
+        Returns the Toolkit API instance of a pipeline configuration, from the cache if possible.
+
+        :param config_path: Root of the pipeline configuration.
+        :returns: Toolkit API instance.
+        """
+        with self._lock:
+            tk = self._tk_cache.get_for_config(config_path)
+        if tk is None:
+            tk = tank.tank_from_path(config_path)
+        return tk
+
+    def _get_context(self, tk, path, previous_context):
+        """
+        Returns the context of a file, from the cache if possible.
+
+        :param tk: Toolkit API instance the path belongs to.
+        :param path: Path of the file.
+        :param previous_context: Context the engine is currently running in.
+        :returns: The context of the file.
+        """
+        with self._lock:
+            context = self._context_cache.get(tk, path, previous_context)
+        if context is not None:
+            self._engine.log_debug("Reusing cached context %s for %s.", context, path)
+            return context
+
+        context = None
+        result = self._query_daemon(path)
+        if result is not None and result["config_path"] == tk.pipeline_configuration.get_path():
+            context = self._context_from_daemon_result(tk, result["context"], previous_context)
+        if context is None:
+            context = tk.context_from_path(path, previous_context)
+        with self._lock:
+            self._context_cache.add(tk, path, previous_context, context)
+        return context
+
+    def _context_from_daemon_result(self, tk, entities, previous_context):
+        """
+        Builds the context of a file from the entities returned by the resolver daemon.
+
+        :param tk: Toolkit API instance the path belongs to.
+        :param entities: Entity dictionaries of the context, keyed by :class:`tank.Context`
+                         constructor parameter names.
+        :param previous_context: Context the engine is currently running in.
+        :returns: The context, or None if it depends on the previous context.
+        """
+        # the daemon does not know about the previous context, which provides
+        # the task of files resolving to the same entity but to no task
+        if (entities["task"] is None and previous_context is not None and
+                previous_context.task is not None and
+                previous_context.entity == entities["entity"]):
+            return None
+        return tank.Context(tk, **dict((str(name), value) for (name, value) in entities.iteritems()))
+
+    def _connect_daemon(self, engine):
+        """
+        Sets up the client of the resolver daemon configured for an engine.
+
+        :param engine: :class:`MayaEngine` instance running in Maya.
+        """
+        socket_path = engine.get_setting("resolver_daemon_socket")
+        if not socket_path or not hasattr(socket, "AF_UNIX"):
+            self._daemon = None
+            return
+        if self._daemon is not None and self._daemon.socket_path == socket_path:
+            return
+        # only loaded when needed, the daemon server is not available on Windows
+        from .resolver_daemon import ResolverClient
+        self._daemon = ResolverClient(socket_path)
+
+    def _query_daemon(self, path):
+        """
+        Asks the resolver daemon to resolve a file.
+
+        :param path: Path of the file.
+        :returns: Result dictionary of the daemon, or None if there is no daemon,
+                  if it could not be reached or if it failed to resolve the file.
+        :raises TankError: If the daemon found that the path does not belong to any
+                           Toolkit project.
+        """
+        daemon = self._daemon
+        if daemon is None:
+            return None
+        reply = daemon.resolve(path)
+        if reply is None:
+            return None
+        if "error" in reply:
+            raise tank.TankError(reply["error"])
+        if "failure" in reply:
+            self._engine.log_debug("Resolver daemon failed to resolve %s: %s", path, reply["failure"])
+            return None
+        return reply["result"]
+
+    def _resolve_in_background(self, path, previous_context):
+        """
+        Resolves the API instance and context of a file so that they get cached.
+        Runs on a worker thread.
+
+        :param path: Path of the file.
+        :param previous_context: Context the engine is currently running in.
+        """
+        start_time = time.time()
+        try:
+            tk = self._get_tk(path)
+            self._get_context(tk, path, previous_context)
+        except Exception, e:
+            # the lookup done once the file is opened will run into the same problem
+            # and report it, the failure is cached when the path does not resolve
+            self._engine.log_debug("Background resolution of %s failed: %s", path, e)
+        else:
+            self._engine.log_debug("Resolved %s in the background in %0.3fs.", path, time.time() - start_time)
+
+    def _warm_up_in_background(self, paths, previous_context, cancelled):
+        """
+        Resolves files so that they get cached. Runs on a worker thread.
+
+        :param paths: Paths of the files to resolve.
+        :param previous_context: Context the engine is currently running in.
+        :param cancelled: Event set when the warm up must stop.
+        """
+        start_time = time.time()
+        resolved = set()
+        for path in self._iter_warm_up_files(paths, previous_context, cancelled):
+            normalized_path = _normalize_path(path)
+            if normalized_path in resolved:
+                continue
+            resolved.add(normalized_path)
+            try:
+                # the files warmed up were not opened by the user, recent files outside
+                # of any project must not prevent folders from being resolved later on
+                tk = self._get_tk(path, remember_unresolved=False)
+                self._get_context(tk, path, previous_context)
+            except Exception:
+                # files which do not resolve are not worth reporting
+                pass
+            if len(resolved) >= self.WARM_UP_MAX_FILES:
+                break
+            cancelled.wait(self.WARM_UP_FILE_INTERVAL)
+
+        self._engine.log_debug("Resolved %d files in the background in %0.3fs.",
+                               len(resolved), time.time() - start_time)
+
+    def _iter_warm_up_files(self, paths, context, cancelled):
+        """
+        Yields the files to resolve during a warm up, until it is cancelled.
+
+        :param paths: Paths of the files to resolve.
+        :param context: Context whose work area folders to look for scene files in.
+        :param cancelled: Event set when the warm up must stop.
+        """
+        for path in paths:
+            if cancelled.is_set():
+                return
+            if os.path.isfile(path):
+                yield path
+
+        if cancelled.is_set():
+            return
+        try:
+            # looked up here rather than by the caller, since this queries
+            # the path cache and possibly Shotgun
+            folders = context.filesystem_locations
+        except Exception, e:
+            self._engine.log_debug("Could not find the work area folders of %s: %s", context, e)
+            return
+
+        for folder in folders:
+            folder_depth = folder.rstrip(os.sep).count(os.sep)
+            for (dir_path, dir_names, file_names) in os.walk(folder):
+                if cancelled.is_set():
+                    return
+                if dir_path.rstrip(os.sep).count(os.sep) - folder_depth >= self.WARM_UP_MAX_DEPTH:
+                    # do not go any deeper
+                    dir_names[:] = []
+                else:
+                    # skip the hidden folders and the Maya backup folders
+                    dir_names[:] = sorted(
+                        name for name in dir_names
+                        if not name.startswith(".") and name not in self.WARM_UP_SKIPPED_FOLDERS
+                    )
+                for file_name in sorted(file_names):
+                    if os.path.splitext(file_name)[1].lower() in _SCENE_EXTENSIONS:
+                        yield os.path.join(dir_path, file_name)
+
+    def _wait_for_prefetch(self, path):
+        """
+        Waits for the background resolution of a file to complete, if there is one.
+
+        :param path: Path of the file about to be looked up.
+        """
+        if self._prefetch is None:
+            return
+        (prefetch_path, thread) = self._prefetch
+        if prefetch_path == _normalize_path(path):
+            thread.join()
+            self._prefetch = None
+        elif not thread.is_alive():
+            self._prefetch = None
@@ -0,0 +1,165 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Scheduler running the deferred work of the engine when Maya is idle.
+"""
+
+import time
+import heapq
+import threading
+
+
+class IdleScheduler(object):
+    """
+    Runs tasks on the main thread once Maya is idle, highest priority first.
+
+    Tasks are run in ticks. Each tick runs tasks until its time slice is used up,
+    and leaves the remaining ones to the next tick, so that Maya can process its
+    UI events in between. Tasks can be scheduled from any thread.
+
+    In batch mode, where there is no event loop to defer work to, tasks are run
+    as soon as they are scheduled.
+    """
+
+    # priorities of the tasks, lower values run first
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 10
+    PRIORITY_LOW = 20
+    # for the tasks which should only run after all the other work waiting to run
+    PRIORITY_IDLE = 30
+
+    # time in seconds a tick can spend running tasks
+    TIME_SLICE = 0.01
+
+    def __init__(self, engine):
+        """
+        Constructor.
+
+        :param engine: :class:`MayaEngine` instance running in Maya.
+        """
+        self._engine = engine
+        # read once, since has_ui runs a Maya command and tasks are scheduled from any thread
+        self._has_ui = engine.has_ui
+        self._main_thread = threading.current_thread()
+        self._lock = threading.Lock()
+        # heap of (priority, sequence number, time scheduled, function, args)
+        self._tasks = []
+        self._sequence = 0
+        self._tick_requested = False
+        # set once the engine owning the scheduler is destroyed
+        self._stopped = False
+        self._stats = {
+            "ticks": 0,
+            "processed": 0,
+            "max_queue_depth": 0,
+            "total_latency": 0.0,
+            "max_latency": 0.0,
+        }
+
+    @property
+    def stats(self):
+        """
+        Dictionary of statistics with keys ``queue_depth``, the number of tasks waiting
+        to run, ``max_queue_depth``, ``ticks``, ``processed``, the number of tasks run,
+        and ``average_latency`` and ``max_latency``, the time in seconds tasks waited
+        before running.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._tasks)
+        total_latency = stats.pop("total_latency")
+        stats["average_latency"] = total_latency / stats["processed"] if stats["processed"] else 0.0
+        return stats
+
+    def schedule(self, priority, fn, *args):
+        """
+        Schedules a task.
+
+        :param priority: Priority of the task, one of the PRIORITY constants.
+        :param fn: Function to call.
+        :param args: Arguments to pass to the function.
+        """
+        if self._stopped:
+            return
+
+        if not self._has_ui:
+            fn(*args)
+            return
+
+        with self._lock:
+            heapq.heappush(self._tasks, (priority, self._sequence, time.time(), fn, args))
+            self._sequence += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self._tasks))
+            if self._tick_requested:
+                return
+            self._tick_requested = True
+        self._request_tick()
+
+    def stop(self):
+        """
+        Drops the tasks waiting to run and ignores the tasks scheduled from now on.
+        Called when the engine owning the scheduler is destroyed, so that the work
+        it deferred does not run against the next engine.
+
+        :returns: The number of tasks which were dropped.
+        """
+        with self._lock:
+            self._stopped = True
+            dropped_count = len(self._tasks)
+            del self._tasks[:]
+        return dropped_count
+
+    def _request_tick(self):
+        """
+        Asks for a tick to run once Maya is idle.
+        """
+        from tank.platform.qt import QtCore
+        if QtCore is not None and threading.current_thread() is self._main_thread:
+            # a single shot timer is used rather than evalDeferred, which runs its commands
+            # a second time from the event loop of a modal dialog shown by these commands
+            QtCore.QTimer.singleShot(0, self._tick)
+        else:
+            import maya.utils
+            maya.utils.executeDeferred(self._tick)
+
+    def _tick(self):
+        """
+        Runs tasks until the time slice is used up or there are no more tasks.
+        """
+        with self._lock:
+            self._tick_requested = False
+            if self._stopped:
+                return
+            self._stats["ticks"] += 1
+
+        start_time = time.time()
+        while True:
+            with self._lock:
+                if self._stopped or not self._tasks:
+                    return
+                if time.time() - start_time >= self.TIME_SLICE:
+                    # leave the remaining tasks to the next tick
+                    if self._tick_requested:
+                        return
+                    self._tick_requested = True
+                    break
+                (_, _, scheduled_time, fn, args) = heapq.heappop(self._tasks)
+                latency = time.time() - scheduled_time
+                self._stats["processed"] += 1
+                self._stats["total_latency"] += latency
+                self._stats["max_latency"] = max(self._stats["max_latency"], latency)
+
+            try:
+                fn(*args)
+            except Exception:
+                self._engine.log_exception("An exception was raised by a deferred task")
+
+        self._request_tick()
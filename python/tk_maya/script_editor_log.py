@@ -0,0 +1,138 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Batched display of the engine log messages in Maya script editor.
+"""
+
+import time
+import logging
+import collections
+
+import maya.OpenMaya as OpenMaya
+
+
+class ScriptEditorLog(object):
+    """
+    Queue of the log messages to display in Maya script editor.
+
+    Messages can be posted from any thread. They are written to the script editor
+    once Maya is idle, all the messages posted in the meantime being written at
+    once, which spares the script editor a refresh per message. Consecutive
+    identical messages are collapsed into one, and debug and info messages over
+    a number of messages per second are dropped, the number of dropped messages
+    being reported instead.
+    """
+
+    def __init__(self, engine, max_messages_per_second):
+        """
+        Constructor.
+
+        :param engine: :class:`MayaEngine` instance running in Maya.
+        :param max_messages_per_second: Maximum number of debug and info messages
+                                        displayed per second, 0 for no limit.
+        """
+        self._engine = engine
+        self._max_messages_per_second = max_messages_per_second
+        # (level, prefix, message) tuples, appended and popped atomically from any thread
+        self._messages = collections.deque()
+        self._flush_requested = False
+        # start time of the current one second window and number of messages displayed in it
+        self._window_start = 0.0
+        self._window_count = 0
+        self._dropped_count = 0
+
+    def post(self, level, msg, prefix=""):
+        """
+        Queues a message for display.
+
+        :param level: Standard python logging level of the message.
+        :param msg: Message to display.
+        :param prefix: Text displayed before the message, such as a time stamp, which
+                       is not compared when collapsing identical messages.
+        """
+        self._messages.append((level, prefix, msg))
+        if not self._flush_requested:
+            # a flush requested twice by concurrent threads only costs an empty flush
+            self._flush_requested = True
+            scheduler = self._engine.scheduler
+            scheduler.schedule(scheduler.PRIORITY_NORMAL, self.flush)
+
+    def flush(self):
+        """
+        Writes the queued messages to the script editor.
+        """
+        self._flush_requested = False
+
+        # collapse the consecutive identical messages, as [level, prefix, message, count] lists,
+        # keeping the prefix of the first one
+        messages = []
+        while self._messages:
+            (level, prefix, msg) = self._messages.popleft()
+            if messages and messages[-1][0] == level and messages[-1][2] == msg:
+                messages[-1][3] += 1
+            else:
+                messages.append([level, prefix, msg, 1])
+
+        # group the lines to display by display function
+        lines = []
+        for (level, prefix, msg, count) in messages:
+            if level < logging.WARNING and not self._allow_message():
+                self._dropped_count += count
+                continue
+            msg = prefix + msg
+            if count > 1:
+                msg = "%s (repeated %d times)" % (msg, count)
+            fct = _get_display_function(level)
+            if lines and lines[-1][0] is fct:
+                lines[-1][1].append(msg)
+            else:
+                lines.append((fct, [msg]))
+
+        if self._dropped_count:
+            lines.append((OpenMaya.MGlobal.displayWarning, [
+                "Shotgun: %d log messages were dropped, over the limit of %d messages per second." %
+                (self._dropped_count, self._max_messages_per_second)
+            ]))
+            self._dropped_count = 0
+
+        for (fct, msgs) in lines:
+            fct("\n".join(msgs))
+
+    def _allow_message(self):
+        """
+        Counts a message against the limit of messages per second.
+
+        :returns: True if the message can be displayed, False if it must be dropped.
+        """
+        if not self._max_messages_per_second:
+            return True
+        now = time.time()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_count = 0
+        if self._window_count >= self._max_messages_per_second:
+            return False
+        self._window_count += 1
+        return True
+
+
+def _get_display_function(level):
+    """
+    Returns the Maya function displaying messages of a logging level.
+
+    :param level: Standard python logging level.
+    :returns: Maya display function.
+    """
+    if level < logging.WARNING:
+        return OpenMaya.MGlobal.displayInfo
+    elif level < logging.ERROR:
+        return OpenMaya.MGlobal.displayWarning
+    return OpenMaya.MGlobal.displayError